@@ -1,7 +1,15 @@
 from app.config import log
 from app.core.database import init_db
-from app.s3.storage import connect_storage
-from app.click.clickhouse import connect_clickhouse
+from app.s3.storage import connect_storage, get_client as get_storage_client
+from app.click.clickhouse import connect_clickhouse, get_client as get_click_client
+from app.click.vector_index import connect_vector_index
+from app.click.tag_index import connect_tag_index, close_tag_index
+from app.cache.redis import connect_redis, close_redis, get_redis
+from app.cache.embedding_cache import connect_embedding_cache
+from app.cache.principal_cache import connect_principal_cache
+from app.nuclio.client import connect_nuclio, close_nuclio, get_client as get_nuclio_client
+from app.utils.imaging import connect_image_pool, close_image_pool
+from app.utils.passwords import connect_password_hasher, close_password_hasher
 from app.config import settings
 
 from fastapi import FastAPI
@@ -10,8 +18,6 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi_cache import FastAPICache
 from fastapi_cache.backends.redis import RedisBackend
 
-from redis import asyncio as aioredis
-
 
 async def startup():
     try:
@@ -21,14 +27,31 @@ async def startup():
         pass
     connect_storage()
     connect_clickhouse()
-    redis = aioredis.from_url(settings.REDIS_URI)
-    FastAPICache.init(RedisBackend(redis), prefix="fastapi-cache")
+    connect_vector_index(get_click_client())
+    connect_redis()
+    FastAPICache.init(RedisBackend(get_redis()), prefix="fastapi-cache")
+    connect_embedding_cache(get_redis())
+    connect_principal_cache(get_redis())
+    connect_password_hasher()
+    connect_nuclio()
+    connect_tag_index(get_nuclio_client())
+    if settings.IMAGE_PROCESSING == "local":
+        connect_image_pool(settings.IMAGE_WORKERS)
+    # imported here, crud needs the session factory created by init_db
+    from app.core.jobs import start_upload_workers
+    start_upload_workers(get_redis(), get_storage_client(), get_click_client(), get_nuclio_client())
 
 
 async def shutdown():
     log.info("shutting down")
     FastAPICache.clear()
-    pass
+    from app.core.jobs import stop_upload_workers
+    await stop_upload_workers()
+    await close_tag_index()
+    await close_nuclio()
+    close_image_pool()
+    close_password_hasher()
+    await close_redis()
 
 
 def create_app() -> FastAPI:
@@ -0,0 +1,77 @@
+"""Convert pickled exif / metainfo of rows written before migration 006 to jsonb
+
+    python -m app.backfill_metadata --batch 500
+
+Rows are walked by id in batches, each batch is one transaction, so the tool
+can be stopped and restarted at any time. Once it reports nothing left the
+exif_pickle / metainfo_pickle columns are no longer read.
+"""
+from argparse import ArgumentParser
+import pickle
+
+from sqlalchemy import bindparam, inspect, text
+from sqlalchemy.dialects.postgresql import JSONB
+
+from app.config import log
+from app.core.database import init_db
+from app.utils.json_safe import json_safe
+
+SELECT_BATCH = text("""
+    SELECT id, exif_pickle, metainfo_pickle FROM image
+    WHERE id > :after AND exif IS NULL AND metainfo IS NULL
+      AND (exif_pickle IS NOT NULL OR metainfo_pickle IS NOT NULL)
+    ORDER BY id
+    LIMIT :batch
+""")
+
+UPDATE_ROW = text("""
+    UPDATE image SET exif = :exif, metainfo = :metainfo WHERE id = :id
+""").bindparams(bindparam("exif", type_=JSONB), bindparam("metainfo", type_=JSONB))
+
+
+def unpickle(raw):
+    if raw is None:
+        return None
+    try:
+        return json_safe(pickle.loads(raw))
+    except Exception as ex:
+        log.warning(f"unreadable pickled value {ex!r}")
+        return {}
+
+
+def run(batch: int) -> int:
+    session_local = init_db()
+    session = session_local()
+    columns = {column["name"] for column in inspect(session.get_bind()).get_columns("image")}
+    if "exif_pickle" not in columns:
+        log.info("no pickled columns, nothing to backfill")
+        return 0
+    converted, after = 0, 0
+    try:
+        while True:
+            rows = session.execute(SELECT_BATCH, {"after": after, "batch": batch}).all()
+            if not rows:
+                break
+            session.execute(UPDATE_ROW, [
+                {"id": image_id, "exif": unpickle(exif) or {}, "metainfo": unpickle(metainfo)}
+                for image_id, exif, metainfo in rows
+            ])
+            session.commit()
+            converted += len(rows)
+            after = rows[-1][0]
+            log.info(f"converted {converted} images, last id {after}")
+    finally:
+        session.close()
+    return converted
+
+
+def main():
+    parser = ArgumentParser(description="Backfill jsonb exif / metainfo from pickled columns")
+    parser.add_argument("--batch", type=int, default=500, help="rows per transaction")
+    args = parser.parse_args()
+    converted = run(args.batch)
+    log.info(f"backfill done, {converted} images converted")
+
+
+if __name__ == "__main__":
+    main()
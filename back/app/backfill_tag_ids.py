@@ -0,0 +1,60 @@
+"""Copy image tags from postgres into the clickhouse `images.tag_ids` column
+
+    python -m app.backfill_tag_ids --batch 10000
+
+Needed once for vectors stored before tag ids were written with every upload.
+Tags are staged in a Join table and applied with a single mutation, the
+shared numpy index is rebuilt afterwards (hnsw indexes reload on api restart).
+"""
+from argparse import ArgumentParser
+
+from sqlalchemy import text
+
+from app.config import log
+from app.config import settings
+from app.core.database import init_db
+from app.click.clickhouse import connect_clickhouse, get_client as get_click_client
+from app.click.vector_index import connect_vector_index
+
+STAGE = "image_tag_ids_backfill"
+
+SELECT_TAGS = text("SELECT image_id, array_agg(tag_id ORDER BY tag_id) FROM image_tag GROUP BY image_id")
+
+
+def run(batch: int) -> int:
+    session_local = init_db()
+    connect_clickhouse()
+    click = get_click_client()
+    click.command(f"DROP TABLE IF EXISTS {STAGE}")
+    click.command(f"CREATE TABLE {STAGE} (`id` Int64, `tag_ids` Array(UInt32)) ENGINE = Join(ANY, LEFT, id)")
+    staged = 0
+    session = session_local()
+    try:
+        result = session.execute(SELECT_TAGS.execution_options(yield_per=batch))
+        for rows in result.partitions():
+            click.insert(STAGE, [list(row) for row in rows], column_names=["id", "tag_ids"])
+            staged += len(rows)
+            log.info(f"staged tags of {staged} images")
+        click.command(
+            f"ALTER TABLE images UPDATE tag_ids = joinGet('{STAGE}', 'tag_ids', id) WHERE empty(tag_ids)",
+            settings={"mutations_sync": 2, "allow_nondeterministic_mutations": 1},
+        )
+    finally:
+        session.close()
+        click.command(f"DROP TABLE IF EXISTS {STAGE}")
+    if settings.VECTOR_BACKEND == "numpy":
+        settings.VECTOR_INDEX_REBUILD = True
+        connect_vector_index(click)
+    return staged
+
+
+def main():
+    parser = ArgumentParser(description="Backfill clickhouse tag_ids from postgres image_tag")
+    parser.add_argument("--batch", type=int, default=10000, help="images per clickhouse insert")
+    args = parser.parse_args()
+    staged = run(args.batch)
+    log.info(f"backfill done, tags of {staged} images written")
+
+
+if __name__ == "__main__":
+    main()
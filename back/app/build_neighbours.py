@@ -0,0 +1,43 @@
+"""Compute the materialized neighbour lists of all images
+
+    python -m app.build_neighbours --batch 500
+
+Uploads and deletes keep the lists up to date afterwards. With the clickhouse
+vector backend every NEIGHBOURS_BATCH images cost one full scan, run it with
+VECTOR_BACKEND=numpy (or hnsw) for big archives.
+"""
+from argparse import ArgumentParser
+
+from app.config import log
+from app.config import settings
+from app.click.clickhouse import connect_clickhouse, get_client as get_click_client
+from app.click.vector_index import connect_vector_index
+from app.click import neighbours
+
+
+def run(batch: int) -> int:
+    connect_clickhouse()
+    click = get_click_client()
+    connect_vector_index(click)
+    if settings.VECTOR_BACKEND == "clickhouse":
+        log.warning(f"no in-process vector index, every {settings.NEIGHBOURS_BATCH} images are a full clickhouse scan")
+    ids = [int(row[0]) for row in click.query("SELECT id FROM images ORDER BY id").result_rows]
+    for start in range(0, len(ids), batch):
+        chunk = ids[start:start + batch]
+        vectors = neighbours.vectors_of(click, chunk)
+        found = neighbours.nearest_many(click, list(vectors.values()), exclude=[[image_id] for image_id in vectors])
+        neighbours.store(click, dict(zip(vectors, found)))
+        log.info(f"neighbours of {start + len(chunk)}/{len(ids)} images stored")
+    return len(ids)
+
+
+def main():
+    parser = ArgumentParser(description="Build the image_neighbours table")
+    parser.add_argument("--batch", type=int, default=500, help="images per clickhouse insert")
+    args = parser.parse_args()
+    count = run(args.batch)
+    log.info(f"neighbours of {count} images built")
+
+
+if __name__ == "__main__":
+    main()
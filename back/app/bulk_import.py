@@ -0,0 +1,89 @@
+"""Bulk import of a photo archive through the upload pipeline
+
+    python -m app.bulk_import /path/to/photos --tags moscow,kremlin --description "partner archive"
+
+Refuses to run with VECTOR_BACKEND=hnsw: imported images would not reach the
+in-memory hnsw index of the api processes until they restart.
+"""
+from argparse import ArgumentParser
+from pathlib import Path
+import asyncio
+import json
+import mimetypes
+import os
+
+from app.config import log
+from app.config import settings
+from app.core.database import init_db
+from app.s3.storage import connect_storage, get_client
+from app.click.clickhouse import connect_clickhouse, get_client as get_click_client
+from app.click.vector_index import connect_vector_index
+from app.click import neighbours
+from app.nuclio.client import connect_nuclio, close_nuclio, get_client as get_nuclio_client
+
+
+async def run(paths, description: str, metainfo: dict, tags: list, chunk: int) -> int:
+    if settings.VECTOR_BACKEND == "hnsw":
+        log.error("VECTOR_BACKEND=hnsw keeps a per-process index the api would not see the import in, "
+                  "upload through the api or use the numpy backend")
+        raise SystemExit(1)
+    session_local = init_db()
+    # crud pulls in core.dependencies, which needs the session factory from init_db
+    from app.core.ingest import IngestFile, ingest_files
+    connect_storage()
+    connect_clickhouse()
+    # the memory-mapped numpy index is shared with the api workers, keep it in sync
+    if settings.VECTOR_BACKEND == "numpy":
+        connect_vector_index(get_click_client())
+    connect_nuclio()
+    session = session_local()
+    failed = 0
+    try:
+        for start in range(0, len(paths), chunk):
+            handles = [open(path, "rb") for path in paths[start:start + chunk]]
+            try:
+                sources = [
+                    IngestFile(
+                        filename=path.name,
+                        content_type=mimetypes.guess_type(path.name)[0] or "",
+                        file=handle,
+                        size=os.path.getsize(path),
+                        description=description,
+                        metainfo=metainfo,
+                        tags=tags,
+                    )
+                    for path, handle in zip(paths[start:start + chunk], handles)
+                ]
+                response = await ingest_files(sources, get_client(), session, get_click_client(), get_nuclio_client())
+            finally:
+                for handle in handles:
+                    handle.close()
+            failed += response.failed
+            for result in response.results:
+                if result.status != "success":
+                    log.error(f"{result.filename}: {result.message}")
+            log.info(f"imported {start + len(sources)}/{len(paths)} files, {failed} failed")
+    finally:
+        session.close()
+        await close_nuclio()
+        # neighbour lists are updated in a background thread, let it finish
+        await asyncio.to_thread(neighbours.wait)
+    return failed
+
+
+def main():
+    parser = ArgumentParser(description="Upload a directory of photos")
+    parser.add_argument("path", type=Path)
+    parser.add_argument("--description", default="")
+    parser.add_argument("--metainfo", default="{}", help="json applied to every photo")
+    parser.add_argument("--tags", default="", help="comma separated")
+    parser.add_argument("--chunk", type=int, default=500, help="files opened at once")
+    args = parser.parse_args()
+    paths = sorted(path for path in args.path.rglob("*") if path.is_file())
+    tags = [tag for tag in args.tags.split(",") if tag]
+    failed = asyncio.run(run(paths, args.description, json.loads(args.metainfo), tags, args.chunk))
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
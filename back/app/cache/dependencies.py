@@ -0,0 +1,4 @@
+from app.cache.embedding_cache import get_embedding_cache
+
+def get_embed_cache():
+    return get_embedding_cache()
@@ -0,0 +1,114 @@
+from app.config import settings
+from app.config import log
+from collections import OrderedDict
+from hashlib import sha1
+from typing import Any, Dict, List, Optional, Tuple
+import time
+import numpy as np
+
+EmbedCache: Any = None
+
+
+def normalize_query(text: str) -> str:
+    """Queries that differ only in case or whitespace share one embedding"""
+    return " ".join(text.casefold().split())
+
+
+class EmbeddingCache:
+    """Two tier embedding cache: in-process LRU, then redis.
+
+    Keys are built from the model id, a kind ("text", ...) and a hash of the value,
+    embeddings are stored in redis as raw float32 bytes.
+    """
+
+    def __init__(self, redis: Any, size: int = None, ttl: int = None, model_id: str = None, prefix: str = "embed") -> None:
+        self.redis = redis
+        self.size = size or settings.EMBEDDING_CACHE_SIZE
+        self.ttl = ttl or settings.EMBEDDING_CACHE_TTL
+        self.model_id = model_id or settings.CLIP_MODEL_ID
+        self.prefix = prefix
+        self.local: "OrderedDict[str, Tuple[float, List[float]]]" = OrderedDict()
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    def key(self, kind: str, value: str) -> str:
+        return f"{self.prefix}:{self.model_id}:{kind}:{sha1(value.encode('utf-8')).hexdigest()}"
+
+    def _get_local(self, key: str) -> Optional[List[float]]:
+        entry = self.local.get(key)
+        if entry is None:
+            return None
+        expires, embed = entry
+        if expires < time.monotonic():
+            del self.local[key]
+            return None
+        self.local.move_to_end(key)
+        return embed
+
+    def _set_local(self, key: str, embed: List[float]) -> None:
+        self.local[key] = (time.monotonic() + self.ttl, embed)
+        self.local.move_to_end(key)
+        while len(self.local) > self.size:
+            self.local.popitem(last=False)
+
+    async def get(self, kind: str, value: str) -> Optional[List[float]]:
+        key = self.key(kind, value)
+        embed = self._get_local(key)
+        if embed is not None:
+            self.local_hits += 1
+            return embed
+        try:
+            raw = await self.redis.get(key)
+        except Exception as ex:
+            log.warning(f"embedding cache redis get failed {ex}")
+            raw = None
+        if raw is None:
+            self.misses += 1
+            return None
+        self.redis_hits += 1
+        embed = np.frombuffer(raw, dtype=np.float32).tolist()
+        self._set_local(key, embed)
+        return embed
+
+    async def set(self, kind: str, value: str, embed: List[float]) -> None:
+        key = self.key(kind, value)
+        self._set_local(key, embed)
+        try:
+            await self.redis.set(key, np.asarray(embed, dtype=np.float32).tobytes(), ex=self.ttl)
+        except Exception as ex:
+            log.warning(f"embedding cache redis set failed {ex}")
+
+    async def get_text(self, text: str) -> Optional[List[float]]:
+        return await self.get("text", normalize_query(text))
+
+    async def set_text(self, text: str, embed: List[float]) -> None:
+        await self.set("text", normalize_query(text), embed)
+
+    async def get_image(self, content_hash: str) -> Optional[List[float]]:
+        """content_hash is the sha256 hex of the image file"""
+        return await self.get("image", content_hash)
+
+    async def set_image(self, content_hash: str, embed: List[float]) -> None:
+        await self.set("image", content_hash, embed)
+
+    def stats(self) -> Dict[str, Any]:
+        hits = self.local_hits + self.redis_hits
+        total = hits + self.misses
+        return {
+            "local_hits": self.local_hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "hit_rate": hits / total if total else 0.0,
+            "inference_calls_saved": hits,
+            "local_size": len(self.local),
+        }
+
+
+def connect_embedding_cache(redis: Any):
+    global EmbedCache
+    EmbedCache = EmbeddingCache(redis)
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    return EmbedCache
@@ -0,0 +1,87 @@
+from app.config import settings
+from app.config import log
+from app.schemas.response_schemas import User
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+import time
+
+PrincipalCache: Any = None
+
+
+class UserCache:
+    """Resolved users of access tokens by subject (email): in-process LRU, then redis.
+
+    Saves the user lookup on every authenticated request. The local tier
+    keeps entries only PRINCIPAL_CACHE_LOCAL_TTL seconds, so a user updated
+    through another worker is seen there soon after `invalidate` cleared redis.
+    """
+
+    def __init__(self, redis: Any, size: int = None, ttl: int = None, local_ttl: int = None, prefix: str = "principal") -> None:
+        self.redis = redis
+        self.size = size or settings.PRINCIPAL_CACHE_SIZE
+        self.ttl = ttl or settings.PRINCIPAL_CACHE_TTL
+        self.local_ttl = min(local_ttl or settings.PRINCIPAL_CACHE_LOCAL_TTL, self.ttl)
+        self.prefix = prefix
+        self.local: "OrderedDict[str, Tuple[float, User]]" = OrderedDict()
+
+    def key(self, email: str) -> str:
+        return f"{self.prefix}:{email}"
+
+    def _get_local(self, key: str) -> Optional[User]:
+        entry = self.local.get(key)
+        if entry is None:
+            return None
+        expires, user = entry
+        if expires < time.monotonic():
+            del self.local[key]
+            return None
+        self.local.move_to_end(key)
+        return user
+
+    def _set_local(self, key: str, user: User) -> None:
+        self.local[key] = (time.monotonic() + self.local_ttl, user)
+        self.local.move_to_end(key)
+        while len(self.local) > self.size:
+            self.local.popitem(last=False)
+
+    async def get(self, email: str) -> Optional[User]:
+        key = self.key(email)
+        user = self._get_local(key)
+        if user is not None:
+            return user
+        try:
+            raw = await self.redis.get(key)
+        except Exception as ex:
+            log.warning(f"principal cache redis get failed {ex}")
+            raw = None
+        if raw is None:
+            return None
+        user = User.model_validate_json(raw)
+        self._set_local(key, user)
+        return user
+
+    async def set(self, user: User) -> None:
+        key = self.key(user.email)
+        self._set_local(key, user)
+        try:
+            await self.redis.set(key, user.model_dump_json(), ex=self.ttl)
+        except Exception as ex:
+            log.warning(f"principal cache redis set failed {ex}")
+
+    async def invalidate(self, *emails: str) -> None:
+        keys = [self.key(email) for email in emails]
+        for key in keys:
+            self.local.pop(key, None)
+        try:
+            await self.redis.delete(*keys)
+        except Exception as ex:
+            log.warning(f"principal cache redis delete failed {ex}")
+
+
+def connect_principal_cache(redis: Any):
+    global PrincipalCache
+    PrincipalCache = UserCache(redis)
+
+
+def get_principal_cache() -> Optional[UserCache]:
+    return PrincipalCache
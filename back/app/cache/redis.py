@@ -0,0 +1,21 @@
+from app.config import settings
+
+from app.config import log
+from typing import Any
+from redis import asyncio as aioredis
+
+Redis: Any
+
+
+def connect_redis():
+    global Redis
+    Redis = aioredis.from_url(settings.REDIS_URI)
+    log.debug("connected to redis " + settings.REDIS_URI)
+
+
+async def close_redis():
+    await Redis.close()
+
+
+def get_redis():
+    return Redis
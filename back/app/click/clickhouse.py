@@ -1,6 +1,7 @@
 from app.config import settings
 
 from app.config import log
+from app.click import neighbours, vector_sql
 from typing import Any
 import clickhouse_connect
 
@@ -10,11 +11,19 @@ Client: Any
 def connect_clickhouse():
     global Client
     Client = clickhouse_connect.get_client(
-        host=settings.CLICKHOUSE_HOST, port=settings.CLICKHOUSE_PORT, username=settings.CLICKHOUSE_USER, password=settings.CLICKHOUSE_PASSWORD, database=settings.CLICKHOUSE_DB
+        host=settings.CLICKHOUSE_HOST, port=settings.CLICKHOUSE_PORT, username=settings.CLICKHOUSE_USER, password=settings.CLICKHOUSE_PASSWORD, database=settings.CLICKHOUSE_DB,
+        # query and bound parameters (embeddings) go in the request body, not the url
+        form_encode_query_params=True,
     )
     log.debug("connected to clikchouse" + settings.CLICKHOUSE_HOST)
     # create table of vectors if not exist
-    Client.command("CREATE TABLE IF NOT EXISTS images (`id` Int64, `text_embedding` Array(Float32), `image_embedding` Array(Float32)) ENGINE MergeTree ORDER BY id")
+    Client.command("CREATE TABLE IF NOT EXISTS images (`id` Int64, `text_embedding` Array(Float32), `image_embedding` Array(Float32), `tag_ids` Array(UInt32)) ENGINE MergeTree ORDER BY id")
+    # tag ids of the image for filtered vector search, fill old rows with `python -m app.backfill_tag_ids`
+    Client.command("ALTER TABLE images ADD COLUMN IF NOT EXISTS `tag_ids` Array(UInt32)")
+    # materialized nearest neighbours, filled with `python -m app.build_neighbours`
+    neighbours.create_table(Client)
+    # quantized first-pass column and ANN index, depending on settings and server version
+    vector_sql.ensure_vector_schema(Client)
     log.debug("table new_table created or exists already!")
 
 def get_client():
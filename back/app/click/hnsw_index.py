@@ -0,0 +1,130 @@
+from app.config import settings
+from app.config import log
+from app.click.vector_index import VectorIndex
+from collections import defaultdict
+from typing import Callable, Dict, FrozenSet, List, Optional, Set, Tuple
+import threading
+import hnswlib
+import numpy as np
+
+
+class HNSWIndex(VectorIndex):
+    """Approximate nearest neighbour search over image embeddings with hnswlib.
+
+    Recall/latency is tuned with settings.HNSW_M, HNSW_EF_CONSTRUCTION (build time)
+    and HNSW_EF_SEARCH (query time). Tag filters are applied inside the graph
+    walk (hnswlib `filter`), so a filtered query still returns k matching images.
+    """
+
+    name = "hnsw"
+
+    def __init__(self, dim: int = None, max_elements: int = None, m: int = None,
+                 ef_construction: int = None, ef_search: int = None) -> None:
+        self.dim = dim or settings.EMBEDDING_DIM
+        self.index = hnswlib.Index(space="cosine", dim=self.dim)
+        self.index.init_index(
+            max_elements=max_elements or settings.HNSW_MAX_ELEMENTS,
+            ef_construction=ef_construction or settings.HNSW_EF_CONSTRUCTION,
+            M=m or settings.HNSW_M,
+            allow_replace_deleted=True,
+        )
+        self.index.set_ef(ef_search or settings.HNSW_EF_SEARCH)
+        self.ids: Set[int] = set()
+        self.tags: Dict[int, FrozenSet[int]] = {}
+        self.by_tag: Dict[int, Set[int]] = defaultdict(set)
+        self.lock = threading.Lock()
+
+    def add(self, ids: List[int], vectors: List[List[float]], tag_ids: List[List[int]] = None) -> None:
+        if not ids:
+            return
+        data = np.asarray(vectors, dtype=np.float32)
+        tag_ids = tag_ids or [[]] * len(ids)
+        with self.lock:
+            needed = len(self.ids) + len(ids)
+            if needed > self.index.get_max_elements():
+                new_size = max(needed, self.index.get_max_elements() * 2)
+                log.info(f"resizing hnsw index to {new_size}")
+                self.index.resize_index(new_size)
+            self.index.add_items(data, np.asarray(ids, dtype=np.int64), replace_deleted=True)
+            self.ids.update(ids)
+            for image_id, tags in zip(ids, tag_ids):
+                self._untag(image_id)
+                self.tags[image_id] = frozenset(tags)
+                for tag_id in self.tags[image_id]:
+                    self.by_tag[tag_id].add(image_id)
+
+    def _untag(self, image_id: int) -> None:
+        for tag_id in self.tags.pop(image_id, ()):
+            self.by_tag[tag_id].discard(image_id)
+
+    def remove(self, ids: List[int]) -> None:
+        with self.lock:
+            for image_id in ids:
+                if image_id in self.ids:
+                    self.index.mark_deleted(image_id)
+                    self.ids.discard(image_id)
+                    self._untag(image_id)
+
+    def _tag_filter(self, tag_ids: List[int], match: str) -> Tuple[Callable[[int], bool], int]:
+        """(hnswlib filter, number of images passing it)"""
+        sets = [self.by_tag.get(tag_id, set()) for tag_id in set(tag_ids)]
+        allowed = set.intersection(*sets) if match == "all" else set.union(*sets)
+        return allowed.__contains__, len(allowed)
+
+    def search(self, vector: List[float], k: int, min_distance: float = -np.inf, max_distance: float = np.inf,
+               tag_ids: List[int] = None, match: str = "any") -> List[Tuple[int, float]]:
+        query = np.asarray(vector, dtype=np.float32).reshape(1, -1)
+        result: List[Tuple[int, float]] = []
+        with self.lock:
+            passes, total = None, len(self.ids)
+            if tag_ids:
+                passes, total = self._tag_filter(tag_ids, match)
+            fetch = min(k, total)
+            while fetch > 0:
+                try:
+                    # filtered queries must run single threaded in hnswlib
+                    labels, distances = self.index.knn_query(query, k=fetch, num_threads=1, filter=passes)
+                except RuntimeError as ex:
+                    # graph can not always yield `total` live neighbours when many are deleted
+                    log.warning(f"hnsw query for {fetch} neighbours failed: {ex}")
+                    if total <= settings.HNSW_EXACT_SEARCH_MAX or fetch == 1:
+                        return self._exact(query, k, passes, min_distance, max_distance)
+                    if result:
+                        # a smaller fetch already succeeded
+                        return result[:k]
+                    fetch //= 2
+                    continue
+                result = [
+                    (int(label), float(distance))
+                    for label, distance in zip(labels[0], distances[0])
+                    if min_distance <= distance <= max_distance
+                ]
+                # results are sorted, so if the farthest one is past max_distance there is nothing more to find
+                if len(result) >= k or fetch >= total or distances[0][-1] > max_distance:
+                    return result[:k]
+                fetch = min(fetch * 2, total)
+        return result[:k]
+
+    def _exact(self, query: np.ndarray, k: int, passes: Optional[Callable[[int], bool]],
+               min_distance: float, max_distance: float) -> List[Tuple[int, float]]:
+        """brute force cosine distances to every (allowed) image, caller holds the lock"""
+        ids = [image_id for image_id in self.ids if passes is None or passes(image_id)]
+        if not ids:
+            return []
+        vectors = np.asarray(self.index.get_items(ids), dtype=np.float32)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        distances = 1 - vectors @ (query[0] / max(float(np.linalg.norm(query)), 1e-12))
+        order = np.argsort(distances, kind="stable")
+        return [
+            (ids[i], float(distances[i]))
+            for i in order if min_distance <= distances[i] <= max_distance
+        ][:k]
+
+    def get_vector(self, image_id: int) -> Optional[List[float]]:
+        with self.lock:
+            if image_id not in self.ids:
+                return None
+            return list(self.index.get_items([image_id])[0])
+
+    def __len__(self) -> int:
+        return len(self.ids)
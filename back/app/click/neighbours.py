@@ -0,0 +1,220 @@
+"""Materialized nearest neighbours of every image.
+
+`image_neighbours` keeps the NEIGHBOURS_K nearest images (cosine distance
+>= 0.02, like cosine_compare) of each image, sorted nearest first. Rows are
+replaced, not updated: ReplacingMergeTree keeps the newest version and reads
+use FINAL. Adding images merges them into the lists they belong to, deleting
+images recomputes the lists that referenced them.
+
+Writes only queue that maintenance (`schedule_add` / `schedule_remove`), a
+background thread applies it in batches of NEIGHBOURS_BATCH images with one
+search per batch, so uploads neither wait for it nor fail with it. Updates
+still queued when the process stops are lost: missing lists are filled on
+first lookup, stale ones are fixed by the next build_neighbours run.
+"""
+from app.config import settings
+from app.config import log
+from app.click.vector_index import get_index
+from app.click.vector_sql import nearest_many_sql, nearest_sql
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import queue
+import threading
+
+Neighbours = List[Tuple[int, float]]
+
+MIN_DISTANCE = 0.02
+
+# ("add", client, ids, vectors) / ("remove", client, ids, None), applied by Worker
+Updates: "queue.Queue[Tuple[str, Any, List[int], Optional[List[List[float]]]]]" = queue.Queue()
+Worker: Optional[threading.Thread] = None
+WorkerLock = threading.Lock()
+
+
+def create_table(client: Any) -> None:
+    client.command(
+        "CREATE TABLE IF NOT EXISTS image_neighbours (`id` Int64, `neighbour_ids` Array(Int64), "
+        "`distances` Array(Float32), `updated_at` DateTime64(3)) ENGINE ReplacingMergeTree(updated_at) ORDER BY id"
+    )
+
+
+def nearest(client: Any, vector: List[float], k: int = None, exclude: Iterable[int] = ()) -> Neighbours:
+    """k nearest (id, distance) of vector, nearest first, `exclude` ids are left out"""
+    k = k or settings.NEIGHBOURS_K
+    exclude = set(exclude)
+    index = get_index()
+    if index is not None:
+        rows = index.search(vector, k + len(exclude), min_distance=MIN_DISTANCE)
+    else:
+        QUERY, PARAMS = nearest_sql(vector, f'score >= {MIN_DISTANCE}', k + len(exclude))
+        rows = client.query(QUERY, parameters=PARAMS).result_rows
+    return [(int(image_id), float(distance)) for image_id, distance in rows if int(image_id) not in exclude][:k]
+
+
+def nearest_many(client: Any, vectors: List[List[float]], k: int = None,
+                 exclude: List[Iterable[int]] = None) -> List[Neighbours]:
+    """nearest(vector, k, exclude) of every vector, clickhouse is searched once per NEIGHBOURS_BATCH vectors"""
+    k = k or settings.NEIGHBOURS_K
+    exclude = [set(ids) for ids in exclude] if exclude is not None else [set() for _ in vectors]
+    if get_index() is not None:
+        return [nearest(client, vector, k, ids) for vector, ids in zip(vectors, exclude)]
+    found: List[Neighbours] = []
+    for start in range(0, len(vectors), settings.NEIGHBOURS_BATCH):
+        chunk = vectors[start:start + settings.NEIGHBOURS_BATCH]
+        skip = exclude[start:start + settings.NEIGHBOURS_BATCH]
+        QUERY, PARAMS = nearest_many_sql(chunk, f'score >= {MIN_DISTANCE}', k + max(len(ids) for ids in skip))
+        rows: List[Neighbours] = [[] for _ in chunk]
+        for q, image_id, distance in client.query(QUERY, parameters=PARAMS).result_rows:
+            if int(image_id) not in skip[q - 1]:
+                rows[q - 1].append((int(image_id), float(distance)))
+        found.extend(row[:k] for row in rows)
+    return found
+
+
+def get_neighbours(client: Any, image_id: int) -> Optional[Neighbours]:
+    """stored neighbours of image, None if they were never computed"""
+    return get_many(client, [image_id]).get(image_id)
+
+
+def get_many(client: Any, image_ids: List[int]) -> Dict[int, Neighbours]:
+    if not image_ids:
+        return {}
+    QUERY = 'SELECT id, neighbour_ids, distances FROM image_neighbours FINAL WHERE id IN {ids:Array(Int64)}'
+    return {
+        int(image_id): list(zip(map(int, neighbour_ids), map(float, distances)))
+        for image_id, neighbour_ids, distances in client.query(QUERY, parameters={'ids': list(image_ids)}).result_rows
+    }
+
+
+def store(client: Any, rows: Dict[int, Neighbours]) -> None:
+    if not rows:
+        return
+    now = datetime.now()
+    data = [
+        [image_id, [n for n, _ in neighbours], [d for _, d in neighbours], now]
+        for image_id, neighbours in rows.items()
+    ]
+    client.insert('image_neighbours', data, column_names=['id', 'neighbour_ids', 'distances', 'updated_at'])
+
+
+def merge(neighbours: Neighbours, additions: Neighbours, k: int) -> Neighbours:
+    """nearest k of both lists, an id present in both keeps its newer distance"""
+    ids = {image_id for image_id, _ in additions}
+    merged = [row for row in neighbours if row[0] not in ids] + additions
+    return sorted(merged, key=lambda row: row[1])[:k]
+
+
+def add(client: Any, image_ids: List[int], vectors: List[List[float]]) -> None:
+    """compute lists of new images and merge them into the lists of their neighbours
+
+    kNN is not symmetric: a new image belongs in the list of every image it is
+    closer to than that image's k-th neighbour. Candidates are the
+    NEIGHBOURS_REVERSE_K nearest images of the new one, which covers all but
+    far-out "hub" relations; lists missed here are corrected by the next
+    build_neighbours run.
+    """
+    k = settings.NEIGHBOURS_K
+    new_ids = set(image_ids)
+    rows: Dict[int, Neighbours] = {}
+    additions: Dict[int, Neighbours] = defaultdict(list)
+    found = nearest_many(client, vectors, max(k, settings.NEIGHBOURS_REVERSE_K), exclude=[[image_id] for image_id in image_ids])
+    for image_id, candidates in zip(image_ids, found):
+        rows[image_id] = candidates[:k]
+        for neighbour_id, distance in candidates:
+            if neighbour_id not in new_ids:
+                additions[neighbour_id].append((image_id, distance))
+    current = get_many(client, list(additions))
+    for neighbour_id, added in additions.items():
+        if neighbour_id not in current:
+            continue  # never computed, filled on first lookup
+        merged = merge(current[neighbour_id], added, k)
+        if merged != current[neighbour_id]:
+            rows[neighbour_id] = merged
+    store(client, rows)
+    log.debug(f"neighbours of {len(image_ids)} new images stored, {len(rows) - len(image_ids)} lists updated")
+
+
+def remove(client: Any, image_ids: List[int]) -> None:
+    """drop lists of deleted images and recompute the lists that referenced them"""
+    removed = [int(image_id) for image_id in image_ids]
+    client.command('ALTER TABLE image_neighbours DELETE WHERE id IN {ids:Array(Int64)}', parameters={'ids': removed})
+    QUERY = 'SELECT id FROM image_neighbours FINAL WHERE hasAny(neighbour_ids, {ids:Array(Int64)})'
+    affected = [int(row[0]) for row in client.query(QUERY, parameters={'ids': removed}).result_rows if int(row[0]) not in removed]
+    if not affected:
+        return
+    # deleted vectors can still be visible while the clickhouse mutation runs
+    vectors = vectors_of(client, affected)
+    found = nearest_many(client, list(vectors.values()), exclude=[[image_id, *removed] for image_id in vectors])
+    store(client, dict(zip(vectors, found)))
+    log.debug(f"neighbours of {len(affected)} images recomputed after deleting {removed}")
+
+
+def vectors_of(client: Any, image_ids: List[int]) -> Dict[int, List[float]]:
+    index = get_index()
+    vectors = {}
+    if index is not None:
+        vectors = {image_id: index.get_vector(image_id) for image_id in image_ids}
+        vectors = {image_id: vector for image_id, vector in vectors.items() if vector is not None}
+    missing = [image_id for image_id in image_ids if image_id not in vectors]
+    if missing:
+        QUERY = 'SELECT id, image_embedding FROM images WHERE id IN {ids:Array(Int64)}'
+        vectors.update((int(image_id), vector) for image_id, vector in client.query(QUERY, parameters={'ids': missing}).result_rows)
+    return vectors
+
+
+def apply(kind: str, client: Any, image_ids: List[int], vectors: Optional[List[List[float]]]) -> None:
+    try:
+        if kind == "add":
+            add(client, image_ids, vectors)
+        else:
+            remove(client, image_ids)
+    except Exception as ex:
+        # the images themselves are stored, only their neighbour lists lag behind
+        log.exception(f"neighbour {kind} of {len(image_ids)} images failed {ex!r}")
+
+
+def work() -> None:
+    while True:
+        items = [Updates.get()]
+        # coalesce queued additions into batches, keeping adds and removes in order
+        while sum(len(item[2]) for item in items) < settings.NEIGHBOURS_BATCH:
+            try:
+                items.append(Updates.get_nowait())
+            except queue.Empty:
+                break
+        batch: Optional[Tuple[str, Any, List[int], Optional[List[List[float]]]]] = None
+        for kind, client, image_ids, vectors in items:
+            if batch is not None and kind == "add" and batch[0] == "add" and batch[1] is client:
+                batch[2].extend(image_ids)
+                batch[3].extend(vectors)
+                continue
+            if batch is not None:
+                apply(*batch)
+            batch = (kind, client, list(image_ids), list(vectors) if vectors is not None else None)
+        apply(*batch)
+        for _ in items:
+            Updates.task_done()
+
+
+def schedule(kind: str, client: Any, image_ids: List[int], vectors: Optional[List[List[float]]] = None) -> None:
+    global Worker
+    with WorkerLock:
+        if Worker is None or not Worker.is_alive():
+            Worker = threading.Thread(target=work, name="neighbours", daemon=True)
+            Worker.start()
+    Updates.put((kind, client, list(image_ids), vectors))
+
+
+def schedule_add(client: Any, image_ids: List[int], vectors: List[List[float]]) -> None:
+    schedule("add", client, image_ids, [list(vector) for vector in vectors])
+
+
+def schedule_remove(client: Any, image_ids: List[int]) -> None:
+    schedule("remove", client, image_ids)
+
+
+def wait() -> None:
+    """block until every queued update is applied (command line tools call it before exiting)"""
+    if Worker is not None:
+        Updates.join()
@@ -0,0 +1,184 @@
+from app.config import settings
+from app.config import log
+from app.click.vector_index import VectorIndex
+from contextlib import contextmanager
+from typing import Any, List, Optional, Tuple
+import fcntl
+import os
+import threading
+import numpy as np
+
+
+class NumpyIndex(VectorIndex):
+    """Exact cosine search over one L2-normalized float32 matrix.
+
+    The matrix, the id array and the row count live in memory-mapped files in
+    settings.VECTOR_INDEX_DIR, so uvicorn workers share them through the page cache
+    and a restart does not reload anything from clickhouse. Deleted rows are
+    tombstoned (id = -1) in place. Tag ids of every row are kept in a
+    zero-padded (rows, max_tags) matrix, tag filters become a boolean mask
+    applied before top-k.
+    """
+
+    name = "numpy"
+
+    def __init__(self, path: str = None, dim: int = None, capacity: int = None, max_tags: int = None) -> None:
+        self.path = path or settings.VECTOR_INDEX_DIR
+        self.dim = dim or settings.EMBEDDING_DIM
+        self.max_tags = max_tags or settings.VECTOR_INDEX_MAX_TAGS
+        # index files written before tags were stored have to be reloaded once
+        self.stale = False
+        os.makedirs(self.path, exist_ok=True)
+        self.lock = threading.Lock()
+        self.lock_file = open(os.path.join(self.path, ".lock"), "a+")
+        size_file = os.path.join(self.path, "size.i64")
+        if not os.path.exists(size_file) or not os.path.exists(self._file("tags.u32")):
+            with self._locked():
+                if not os.path.exists(size_file):
+                    self._create(capacity or settings.VECTOR_INDEX_CAPACITY)
+                elif not os.path.exists(self._file("tags.u32")):
+                    with open(self._file("tags.u32"), "wb") as f:
+                        f.truncate(os.path.getsize(self._file("ids.i64")) // 8 * self.max_tags * 4)
+                    self.stale = True
+        self.size = np.memmap(size_file, dtype=np.int64, mode="r+", shape=(1,))
+        self._map()
+
+    @contextmanager
+    def _locked(self):
+        # threading lock for this process, flock for the other workers
+        with self.lock:
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _create(self, capacity: int) -> None:
+        with open(self._file("embeddings.f32"), "wb") as f:
+            f.truncate(capacity * self.dim * 4)
+        with open(self._file("ids.i64"), "wb") as f:
+            f.truncate(capacity * 8)
+        with open(self._file("tags.u32"), "wb") as f:
+            f.truncate(capacity * self.max_tags * 4)
+        # size goes last, its presence marks the index as created
+        with open(self._file("size.i64"), "wb") as f:
+            f.truncate(8)
+
+    def _map(self) -> None:
+        self.capacity = os.path.getsize(self._file("ids.i64")) // 8
+        self.embeddings = np.memmap(self._file("embeddings.f32"), dtype=np.float32, mode="r+", shape=(self.capacity, self.dim))
+        self.ids = np.memmap(self._file("ids.i64"), dtype=np.int64, mode="r+", shape=(self.capacity,))
+        self.tags = np.memmap(self._file("tags.u32"), dtype=np.uint32, mode="r+", shape=(self.capacity, self.max_tags))
+
+    def _rows(self) -> int:
+        """Number of used rows, remapping if another worker grew the files"""
+        n = int(self.size[0])
+        if n > self.capacity:
+            self._map()
+        return n
+
+    def _grow(self, needed: int) -> None:
+        capacity = max(needed, self.capacity * 2)
+        log.info(f"growing numpy index to {capacity} rows")
+        self.embeddings.flush()
+        self.ids.flush()
+        self.tags.flush()
+        with open(self._file("embeddings.f32"), "r+b") as f:
+            f.truncate(capacity * self.dim * 4)
+        with open(self._file("ids.i64"), "r+b") as f:
+            f.truncate(capacity * 8)
+        with open(self._file("tags.u32"), "r+b") as f:
+            f.truncate(capacity * self.max_tags * 4)
+        self._map()
+
+    def _tombstone(self, n: int, ids: List[int]) -> None:
+        slots = np.flatnonzero(np.isin(self.ids[:n], ids))
+        self.ids[slots] = -1
+        self.embeddings[slots] = 0
+        self.tags[slots] = 0
+
+    def _append(self, ids: List[int], vectors: List[List[float]], tag_ids: List[List[int]] = None) -> None:
+        n = self._rows()
+        self._tombstone(n, ids)
+        data = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(data, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        if n + len(ids) > self.capacity:
+            self._grow(n + len(ids))
+        self.embeddings[n:n + len(ids)] = data / norms
+        self.tags[n:n + len(ids)] = 0
+        for row, tags in enumerate(tag_ids or []):
+            if len(tags) > self.max_tags:
+                log.warning(f"image {ids[row]} has {len(tags)} tags, only {self.max_tags} are used for filtering")
+            tags = list(tags)[:self.max_tags]
+            self.tags[n + row, :len(tags)] = tags
+        self.ids[n:n + len(ids)] = ids
+        # publish rows only after they are written
+        self.size[0] = n + len(ids)
+
+    def add(self, ids: List[int], vectors: List[List[float]], tag_ids: List[List[int]] = None) -> None:
+        if not ids:
+            return
+        with self._locked():
+            self._append(ids, vectors, tag_ids)
+
+    def remove(self, ids: List[int]) -> None:
+        with self._locked():
+            self._tombstone(self._rows(), ids)
+
+    def _tag_mask(self, n: int, tag_ids: List[int], match: str) -> np.ndarray:
+        """rows having any / all of tag_ids"""
+        tags = self.tags[:n]
+        wanted = np.unique(np.asarray(tag_ids, dtype=np.uint32))
+        if match == "all":
+            return np.all([np.any(tags == tag_id, axis=1) for tag_id in wanted], axis=0)
+        return np.any(np.isin(tags, wanted), axis=1)
+
+    def search(self, vector: List[float], k: int, min_distance: float = -np.inf, max_distance: float = np.inf,
+               tag_ids: List[int] = None, match: str = "any") -> List[Tuple[int, float]]:
+        n = self._rows()
+        if n == 0 or k <= 0:
+            return []
+        query = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm > 0:
+            query = query / norm
+        ids = self.ids[:n]
+        distances = 1 - self.embeddings[:n] @ query
+        keep = (ids >= 0) & (distances >= min_distance) & (distances <= max_distance)
+        if tag_ids:
+            keep &= self._tag_mask(n, tag_ids, match)
+        candidates = np.flatnonzero(keep)
+        if candidates.shape[0] > k:
+            candidates = candidates[np.argpartition(distances[candidates], k - 1)[:k]]
+        candidates = candidates[np.argsort(distances[candidates])]
+        return [(int(ids[i]), float(distances[i])) for i in candidates]
+
+    def get_vector(self, image_id: int) -> Optional[List[float]]:
+        n = self._rows()
+        slots = np.flatnonzero(self.ids[:n] == image_id)
+        if slots.shape[0] == 0:
+            return None
+        return self.embeddings[slots[-1]].tolist()
+
+    def __len__(self) -> int:
+        n = self._rows()
+        return int(np.count_nonzero(self.ids[:n] >= 0))
+
+    def load(self, client: Any) -> None:
+        """Reuse the memory-mapped matrix if it is already filled, otherwise load from clickhouse"""
+        with self._locked():
+            if self._rows() > 0 and not settings.VECTOR_INDEX_REBUILD and not self.stale:
+                log.info(f"numpy index reuses {len(self)} vectors from {self.path}")
+                return
+            self.size[0] = 0
+            count = 0
+            with client.query_row_block_stream("SELECT id, image_embedding, tag_ids FROM images") as stream:
+                for block in stream:
+                    self._append([int(row[0]) for row in block], [row[1] for row in block], [row[2] for row in block])
+                    count += len(block)
+            self.stale = False
+            log.info(f"numpy index loaded {count} vectors")
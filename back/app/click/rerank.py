@@ -0,0 +1,84 @@
+"""Pick a small, diverse result set out of the nearest candidates.
+
+Candidates are (id, cosine distance) rows sorted nearest first, as returned
+by cosine_compare / neighbours. Only RERANK_CANDIDATES of them are ever
+fetched. Two selections, chosen by RERANK_METHOD:
+
+- "banded": one image per similarity band, walking down from the best near
+  duplicate. After a pick the next band starts RERANK_BAND_GAP below it, so
+  results are spread over the similarity range.
+- "mmr": maximal marginal relevance over the candidate embeddings. Each step
+  takes the candidate maximizing
+  (1 - RERANK_DIVERSITY) * similarity - RERANK_DIVERSITY * max similarity to the picked ones.
+
+Candidates less similar than RERANK_MIN_SIMILARITY are never returned.
+"""
+from app.config import settings
+from app.click import neighbours
+from typing import Any, List, Tuple
+import numpy as np
+
+Rows = List[Tuple[int, float]]
+
+# similarity of the first band, best candidates above it are near duplicates
+BAND_TOP = 0.9
+BAND_STEP = 0.01
+
+
+def banded(rows: Rows, count: int, gap: float, floor: float) -> Rows:
+    """best candidate of each similarity band, bands found with searchsorted on the sorted similarities"""
+    similarity = 1 - np.asarray([distance for _, distance in rows], dtype=np.float64)
+    # searchsorted needs ascending order, similarities come in descending
+    descending = -similarity
+    picked = []
+    if similarity[0] >= BAND_TOP:
+        picked.append(0)
+    top = min(BAND_TOP, similarity[0])
+    while len(picked) < count:
+        # first candidate below the current band top
+        i = int(np.searchsorted(descending, -top, side="right"))
+        if i == len(rows):
+            break
+        # bands below `top` are BAND_STEP wide, skip the empty ones at once
+        top -= BAND_STEP * np.floor((top - similarity[i]) / BAND_STEP)
+        if top - BAND_STEP <= floor:
+            break
+        picked.append(i)
+        top = similarity[i] - gap
+    return [rows[i] for i in picked]
+
+
+def mmr(rows: Rows, vectors: np.ndarray, count: int, diversity: float) -> Rows:
+    """maximal marginal relevance, relevance is the similarity to the query from `rows`"""
+    relevance = 1 - np.asarray([distance for _, distance in rows], dtype=np.float32)
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    pairwise = vectors @ vectors.T
+    # highest similarity of every candidate to the picked ones
+    redundancy = np.full(len(rows), -np.inf, dtype=np.float32)
+    available = np.ones(len(rows), dtype=bool)
+    picked = []
+    for _ in range(min(count, len(rows))):
+        score = (1 - diversity) * relevance - diversity * np.maximum(redundancy, 0)
+        score[~available] = -np.inf
+        i = int(score.argmax())
+        picked.append(i)
+        available[i] = False
+        redundancy = np.maximum(redundancy, pairwise[i])
+    return [rows[i] for i in picked]
+
+
+def rerank(client: Any, rows: Rows, count: int = None) -> Rows:
+    """`count` (RERANK_COUNT) diverse rows out of the nearest-first candidates"""
+    count = count or settings.RERANK_COUNT
+    rows = [row for row in rows[:settings.RERANK_CANDIDATES] if 1 - row[1] >= settings.RERANK_MIN_SIMILARITY]
+    if not rows:
+        return []
+    if settings.RERANK_METHOD == "mmr":
+        ids = [int(image_id) for image_id, _ in rows]
+        found = neighbours.vectors_of(client, ids)
+        rows = [row for row in rows if int(row[0]) in found]
+        if not rows:
+            return []
+        vectors = np.asarray([found[int(image_id)] for image_id, _ in rows], dtype=np.float32)
+        return mmr(rows, vectors, count, settings.RERANK_DIVERSITY)
+    return banded(rows, count, settings.RERANK_BAND_GAP, settings.RERANK_MIN_SIMILARITY)
@@ -0,0 +1,134 @@
+"""Zero-shot tag prediction against text embeddings of all tags.
+
+Every row of the `tag` table is embedded once by the text encoder
+(TAG_PROMPT_TEMPLATE, e.g. "a photo of {}") into one L2-normalized float32
+matrix kept in the process. The refresh task diffs the ids of all tags
+against the embedded ones and embeds only the missing tags, also those whose
+transaction committed after one with a higher id. It runs right
+after an upload created unknown tags (`stale`) and every
+TAG_INDEX_REFRESH_SECONDS for tags created by other processes. Predicting is
+one mat-vec of the image embedding against the matrix, confidences are the
+CLIP softmax over all tags.
+"""
+from app.config import settings
+from app.config import log
+from app.core import database
+from app.nuclio.client import NuclioClient, InferenceError
+from app.schemas import response_schemas
+from typing import Iterable, List, Optional, Set
+import asyncio
+import threading
+import numpy as np
+
+TagIndex: Optional["TagMatrix"] = None
+RefreshTask: Optional[asyncio.Task] = None
+
+
+class TagMatrix:
+
+    def __init__(self, dim: int = None) -> None:
+        self.dim = dim or settings.EMBEDDING_DIM
+        self.ids = np.empty(0, dtype=np.int64)
+        self.names: List[str] = []
+        self.matrix = np.empty((0, self.dim), dtype=np.float32)
+        self.known: Set[int] = set()
+        # set when an upload linked tags that are not embedded yet
+        self.stale = False
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def add(self, ids: List[int], names: List[str], vectors: List[List[float]]) -> None:
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(ids), self.dim)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        with self.lock:
+            # readers keep the arrays they already took, nothing is modified in place
+            self.ids = np.concatenate([self.ids, np.asarray(ids, dtype=np.int64)])
+            self.names = self.names + list(names)
+            self.matrix = np.concatenate([self.matrix, vectors])
+            self.known = self.known | set(ids)
+
+    def mark_unknown(self, tag_ids: Iterable[int]) -> None:
+        if any(tag_id not in self.known for tag_id in tag_ids):
+            self.stale = True
+
+    def predict(self, embed: List[float], top_n: int = None) -> List[response_schemas.ScoredTag]:
+        """top_n tags most likely on the image, with softmax confidences, most likely first"""
+        top_n = top_n or settings.TAG_PREDICT_TOP_N
+        with self.lock:
+            ids, names, matrix = self.ids, self.names, self.matrix
+        if not names:
+            return []
+        vector = np.asarray(embed, dtype=np.float32)
+        logits = settings.TAG_PREDICT_LOGIT_SCALE * (matrix @ (vector / max(float(np.linalg.norm(vector)), 1e-12)))
+        probs = np.exp(logits - logits.max())
+        probs /= probs.sum()
+        top = np.argpartition(-probs, min(top_n, len(names)) - 1)[:top_n]
+        top = top[np.argsort(-probs[top])]
+        return [
+            response_schemas.ScoredTag(id=int(ids[i]), name=names[i], confidence=float(probs[i]))
+            for i in top if probs[i] >= settings.TAG_PREDICT_MIN_CONFIDENCE
+        ]
+
+    async def refresh(self, nuclio: NuclioClient) -> int:
+        """embed tags created since the last refresh, returns how many were added"""
+        # imported here, crud needs the session factory created by init_db
+        from app.core import crud
+        self.stale = False
+
+        def query(fn, *args):
+            session = database.SessionLocal()
+            try:
+                return fn(session, *args)
+            finally:
+                session.close()
+
+        missing = sorted(await asyncio.to_thread(query, crud.get_tag_id_set) - self.known)
+        added = 0
+        for start in range(0, len(missing), settings.NUCLIO_MAX_BATCH):
+            tags = await asyncio.to_thread(query, crud.get_tags_by_ids, missing[start:start + settings.NUCLIO_MAX_BATCH])
+            if not tags:
+                continue
+            vectors = await nuclio.embed_texts([settings.TAG_PROMPT_TEMPLATE.format(tag.name) for tag in tags])
+            self.add([tag.id for tag in tags], [tag.name for tag in tags], vectors)
+            added += len(tags)
+        if added:
+            log.info(f"tag index embedded {added} new tags, {len(self)} total")
+        return added
+
+
+async def keep_fresh(index: TagMatrix, nuclio: NuclioClient) -> None:
+    ticks = 0
+    while True:
+        try:
+            if index.stale or ticks == 0:
+                await index.refresh(nuclio)
+        except InferenceError:
+            index.stale = True
+        except Exception as ex:
+            log.exception(f"tag index refresh failed {ex!r}")
+        ticks = (ticks + 1) % max(int(settings.TAG_INDEX_REFRESH_SECONDS), 1)
+        await asyncio.sleep(1)
+
+
+def connect_tag_index(nuclio: NuclioClient) -> None:
+    global TagIndex, RefreshTask
+    if not settings.TAG_PREDICT:
+        log.info("zero-shot tag prediction disabled")
+        return
+    TagIndex = TagMatrix()
+    # the first refresh embeds all tags in the background, predictions start once it has some
+    RefreshTask = asyncio.create_task(keep_fresh(TagIndex, nuclio))
+
+
+async def close_tag_index() -> None:
+    global RefreshTask
+    if RefreshTask is not None:
+        RefreshTask.cancel()
+        await asyncio.gather(RefreshTask, return_exceptions=True)
+        RefreshTask = None
+
+
+def get_tag_index() -> Optional[TagMatrix]:
+    return TagIndex
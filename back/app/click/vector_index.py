@@ -0,0 +1,86 @@
+from app.config import settings
+from app.config import log
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Tuple, Type
+import numpy as np
+
+
+class VectorIndex(ABC):
+    """Base class for in-process vector search backends.
+
+    Distances are cosine distances (1 - cosine similarity), same as
+    clickhouse `cosineDistance`, so backends are interchangeable. Every vector
+    carries the tag ids of its image, searches can be restricted to images
+    having any / all of given tags (clickhouse `hasAny` / `hasAll`).
+    """
+
+    name = "base"
+
+    @abstractmethod
+    def add(self, ids: List[int], vectors: List[List[float]], tag_ids: List[List[int]] = None) -> None:
+        ...
+
+    @abstractmethod
+    def remove(self, ids: List[int]) -> None:
+        ...
+
+    @abstractmethod
+    def search(self, vector: List[float], k: int, min_distance: float = -np.inf, max_distance: float = np.inf,
+               tag_ids: List[int] = None, match: str = "any") -> List[Tuple[int, float]]:
+        """Return up to k (id, distance) pairs with min_distance <= distance <= max_distance, nearest first
+
+        with `tag_ids` only images having any (match="any") or all (match="all") of them are considered
+        """
+
+    @abstractmethod
+    def get_vector(self, image_id: int) -> Optional[List[float]]:
+        ...
+
+    @abstractmethod
+    def __len__(self) -> int:
+        ...
+
+    def load(self, client: Any) -> None:
+        """Fill index from clickhouse `images` table"""
+        count = 0
+        with client.query_row_block_stream("SELECT id, image_embedding, tag_ids FROM images") as stream:
+            for block in stream:
+                ids = [int(row[0]) for row in block]
+                vectors = [row[1] for row in block]
+                self.add(ids, vectors, [row[2] for row in block])
+                count += len(ids)
+        log.info(f"{self.name} index loaded {count} vectors")
+
+
+def _hnsw_backend() -> Type[VectorIndex]:
+    from app.click.hnsw_index import HNSWIndex
+    return HNSWIndex
+
+
+def _numpy_backend() -> Type[VectorIndex]:
+    from app.click.numpy_index import NumpyIndex
+    return NumpyIndex
+
+
+BACKENDS: Dict[str, Any] = {
+    "numpy": _numpy_backend,
+    "hnsw": _hnsw_backend,
+}
+
+Index: Optional[VectorIndex] = None
+
+
+def connect_vector_index(client: Any):
+    """Build vector index selected by settings.VECTOR_BACKEND. clickhouse backend keeps Index = None"""
+    global Index
+    if settings.VECTOR_BACKEND not in BACKENDS:
+        log.info(f"vector backend {settings.VECTOR_BACKEND}, no in-process index")
+        Index = None
+        return
+    index = BACKENDS[settings.VECTOR_BACKEND]()()
+    index.load(client)
+    Index = index
+
+
+def get_index() -> Optional[VectorIndex]:
+    return Index
@@ -0,0 +1,155 @@
+"""Optional ClickHouse vector schema and the top-k queries using it.
+
+With CLICKHOUSE_QUANTIZATION the `images` table keeps a MATERIALIZED int8
+(or bfloat16) copy of image_embedding. Top-k queries scan the small copy for
+CLICKHOUSE_RERANK_CANDIDATES candidates and rerank only those against the
+full-precision vectors. On servers with the vector_similarity index
+(CLICKHOUSE_ANN_INDEX, 25.1+) candidates come from the ANN index instead.
+
+Both trade recall for speed and are off by default. The score condition is
+applied after the exact rerank, so returned scores are exact, but an image
+the first pass ranked below CLICKHOUSE_RERANK_CANDIDATES is missed even when
+it passes the condition (e.g. a near duplicate under 0.02).
+"""
+from app.config import settings
+from app.config import log
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+
+# mode -> (column type, expression over image_embedding)
+QUANTIZED_COLUMNS = {
+    # L2-normalized, scaled to [-127, 127]: cosine distance is kept, 1 byte per value
+    "int8": ("Array(Int8)", "arrayMap(x -> toInt8(round(x * 127 / greatest(L2Norm(image_embedding), 1e-12))), image_embedding)"),
+    "bfloat16": ("Array(BFloat16)", "CAST(image_embedding, 'Array(BFloat16)')"),
+}
+
+ANN_INDEX = "ix_image_embedding_ann"
+
+Quantization: Optional[str] = None
+AnnIndex: bool = False
+
+
+def column_exists(client: Any, table: str, column: str) -> bool:
+    return client.command(
+        "SELECT count() FROM system.columns WHERE database = currentDatabase() AND table = {table:String} AND name = {name:String}",
+        parameters={'table': table, 'name': column},
+    ) > 0
+
+
+def index_exists(client: Any, table: str, index: str) -> bool:
+    return client.command(
+        "SELECT count() FROM system.data_skipping_indices WHERE database = currentDatabase() AND table = {table:String} AND name = {name:String}",
+        parameters={'table': table, 'name': index},
+    ) > 0
+
+
+def ensure_quantized_column(client: Any) -> Optional[str]:
+    mode = settings.CLICKHOUSE_QUANTIZATION
+    if mode not in QUANTIZED_COLUMNS:
+        return None
+    if mode == "bfloat16" and not client.min_version("24.11"):
+        log.warning(f"clickhouse {client.server_version} has no BFloat16, using int8 quantization")
+        mode = "int8"
+    column = f"image_embedding_{mode}"
+    if not column_exists(client, "images", column):
+        column_type, expression = QUANTIZED_COLUMNS[mode]
+        client.command(
+            f"ALTER TABLE images ADD COLUMN {column} {column_type} MATERIALIZED {expression}",
+            settings={"allow_experimental_bfloat16_type": 1} if mode == "bfloat16" else None,
+        )
+        # rows stored before the column existed are written by a background mutation
+        client.command(f"ALTER TABLE images MATERIALIZE COLUMN {column}")
+        log.info(f"added {column} to images, materializing existing rows")
+    return mode
+
+
+def ensure_ann_index(client: Any) -> bool:
+    if not settings.CLICKHOUSE_ANN_INDEX:
+        return False
+    if not client.min_version("25.1"):
+        log.info(f"clickhouse {client.server_version} has no vector_similarity index")
+        return False
+    if not index_exists(client, "images", ANN_INDEX):
+        client.command(
+            f"ALTER TABLE images ADD INDEX {ANN_INDEX} image_embedding "
+            f"TYPE vector_similarity('hnsw', 'cosineDistance', {settings.EMBEDDING_DIM})",
+            settings={"allow_experimental_vector_similarity_index": 1},
+        )
+        client.command(f"ALTER TABLE images MATERIALIZE INDEX {ANN_INDEX}")
+        log.info(f"added {ANN_INDEX} to images, building it for existing rows")
+    return True
+
+
+def ensure_vector_schema(client: Any) -> None:
+    global Quantization, AnnIndex
+    Quantization = ensure_quantized_column(client)
+    AnnIndex = ensure_ann_index(client)
+    log.debug(f"clickhouse vector search: quantization {Quantization}, ann index {AnnIndex}")
+
+
+def nearest_many_sql(embeds: List[List[float]], score_condition: str, limit: int) -> Tuple[str, Dict[str, Any]]:
+    """(query, parameters) selecting q, id, score: the `limit` nearest images of every embedding
+
+    q is the 1-based position of the embedding in `embeds`. All embeddings are
+    compared in a single exact scan of the table.
+    """
+    params = {'embeds': [vector_param(embed) for embed in embeds], 'n': len(embeds), 'limit': limit}
+    return (
+        'SELECT q, id, cosineDistance(image_embedding, arrayElement({embeds:Array(Array(Float32))}, q)) AS score '
+        'FROM images CROSS JOIN (SELECT arrayJoin(range(1, {n:UInt32} + 1)) AS q) AS queries '
+        f'WHERE {score_condition} ORDER BY q ASC, score ASC LIMIT {{limit:UInt32}} BY q'
+    ), params
+
+
+def vector_param(embed: List[float]) -> List[float]:
+    """embedding as float32-precision values (8 significant digits), half the text of a float64 repr"""
+    return [float(f"{value:.8g}") for value in np.asarray(embed, dtype=np.float32).tolist()]
+
+
+def tag_condition(tag_ids: List[int] = None, match: str = "any") -> Tuple[str, Dict[str, Any]]:
+    """(AND clause keeping rows having any / all of tag_ids, its parameters), empty without tags"""
+    if not tag_ids:
+        return '', {}
+    function = 'hasAll' if match == 'all' else 'hasAny'
+    return f' AND {function}(tag_ids, {{tag_ids:Array(UInt32)}})', {'tag_ids': [int(tag_id) for tag_id in tag_ids]}
+
+
+def quantized_reference(embed: List[float]) -> Tuple[str, str, Dict[str, Any]]:
+    """(column, expression, parameters) to compare against the quantized copy"""
+    if Quantization == "int8":
+        vector = np.asarray(embed, dtype=np.float32)
+        vector = np.round(vector * 127 / max(float(np.linalg.norm(vector)), 1e-12)).astype(np.int8)
+        return "image_embedding_int8", "{quantized:Array(Int8)}", {'quantized': vector.tolist()}
+    return "image_embedding_bfloat16", "CAST({embed:Array(Float32)}, 'Array(BFloat16)')", {}
+
+
+def nearest_sql(embed: List[float], score_condition: str, limit: Optional[int], tag_ids: List[int] = None,
+                match: str = "any", column: str = "image_embedding") -> Tuple[str, Dict[str, Any]]:
+    """(query, parameters) selecting id, score (cosine distance) of images passing the conditions, nearest first
+
+    score_condition is on `score` (e.g. 'score >= 0.02'). The embedding is bound
+    as a typed {embed:Array(Float32)} parameter, ClickHouse reads it without
+    going through the SQL parser. Unlimited queries are always exact.
+    """
+    tags, params = tag_condition(tag_ids, match)
+    params['embed'] = vector_param(embed)
+    exact = f'SELECT id, cosineDistance({column}, {{embed:Array(Float32)}}) AS score FROM images WHERE {score_condition}{tags} ORDER BY score ASC'
+    if limit is None:
+        return exact, params
+    params['limit'] = limit
+    candidates = max(settings.CLICKHOUSE_RERANK_CANDIDATES, limit * 4)
+    if column != "image_embedding":
+        return f'{exact} LIMIT {{limit:UInt32}}', params
+    if AnnIndex and not tags:
+        # plain ORDER BY distance LIMIT n is what the ANN index can serve
+        first_pass = f'SELECT id FROM images ORDER BY cosineDistance(image_embedding, {{embed:Array(Float32)}}) ASC LIMIT {candidates}'
+    elif Quantization is not None:
+        quantized, reference, quantized_params = quantized_reference(embed)
+        params.update(quantized_params)
+        first_pass = f'SELECT id FROM images WHERE 1{tags} ORDER BY cosineDistance({quantized}, {reference}) ASC LIMIT {candidates}'
+    else:
+        return f'{exact} LIMIT {{limit:UInt32}}', params
+    return (
+        f'SELECT id, cosineDistance(image_embedding, {{embed:Array(Float32)}}) AS score FROM images '
+        f'WHERE id IN ({first_pass}) AND {score_condition} ORDER BY score ASC LIMIT {{limit:UInt32}}'
+    ), params
@@ -1,41 +1,83 @@
 from app.config import log
-from typing import Any, List, Union
+from app.config import settings
+from app.click.vector_index import get_index
+from app.click import neighbours
+from app.click.vector_sql import nearest_sql
+from typing import Any, List, Tuple
 import clickhouse_connect
 
-def cosine_compare(client: Any, input_embed: List[float], to_image: bool = True, limit: bool = True) -> List:
-    """Find similar to embed from clickhouse"""
-    PARAMS = {'emebed': input_embed}
-    Limit = 'LIMIT 5'
+def cosine_compare(client: Any, input_embed: List[float], to_image: bool = True, limit: bool = True,
+                   tag_ids: List[int] = None, match: str = "any", k: int = None) -> List:
+    """Find similar to embed from clickhouse, optionally only among images with any / all of tag_ids
+
+    returns the 5 nearest, the `k` nearest if given, all of them with limit=False
+    """
+    index = get_index()
+    if index is not None and to_image:
+        k = k or (5 if limit else settings.VECTOR_UNLIMITED_K)
+        return index.search(input_embed, k, min_distance=0.02, tag_ids=tag_ids, match=match)
     if to_image:
-        QUERY = f'SELECT id, cosineDistance(image_embedding, {input_embed}) AS score FROM images WHERE score >= 0.02 ORDER BY score ASC {Limit if limit else ""}'
+        QUERY, PARAMS = nearest_sql(input_embed, 'score >= 0.02', k or (5 if limit else None), tag_ids, match)
     else:
-        QUERY = f'SELECT id, cosineDistance(text_embedding, {input_embed}) AS score FROM images WHERE score >= 0.02 ORDER BY score ASC LIMIT 5'
-    result = client.query(QUERY)
+        QUERY, PARAMS = nearest_sql(input_embed, 'score >= 0.02', 5, tag_ids, match, column='text_embedding')
+    result = client.query(QUERY, parameters=PARAMS)
     return result.result_rows
 
-def check_if_similar(client: Any, input_embed: List[float]) -> Union[bool, List]:
-    """Check if image is similar to any in clickhouse"""
-    PARAMS = {'emebed': input_embed}
-    QUERY = f'SELECT id, cosineDistance(image_embedding, {input_embed}) AS score FROM images WHERE score <= 0.02 ORDER BY score ASC LIMIT 1'
-    result = client.query(QUERY)
-    if result.result_rows:
-        return result.result_rows
-    return False
+def neighbourhood(client: Any, input_embed: List[float], k: int = None) -> Tuple[List, List]:
+    """(duplicates, neighbours) of embed from one top-k search
+
+    duplicates are closer than 0.02, neighbours are the rest of the k nearest
+    (what cosine_compare finds), nearest first.
+    """
+    k = k or settings.SUGGEST_NEIGHBOURS
+    index = get_index()
+    if index is not None:
+        rows = index.search(input_embed, k)
+    else:
+        QUERY, PARAMS = nearest_sql(input_embed, '1', k)
+        rows = client.query(QUERY, parameters=PARAMS).result_rows
+    duplicates = [row for row in rows if row[1] < 0.02]
+    neighbours = [row for row in rows if row[1] >= 0.02]
+    return duplicates, neighbours
 
 def get_image_vector(client: Any, image_id: int) -> List:
     """Get image vector from clickhouse"""
-    QUERY = f'SELECT image_embedding FROM images WHERE id = {image_id}'
-    result = client.query(QUERY)
+    index = get_index()
+    if index is not None:
+        vector = index.get_vector(image_id)
+        if vector is not None:
+            return vector
+    QUERY = 'SELECT image_embedding FROM images WHERE id = {id:Int64}'
+    result = client.query(QUERY, parameters={'id': image_id})
     return result.result_rows[0][0]
 
-def add_image(client: Any, image_id: int, image_embedding: List[float], text_embedding: List[float]) -> None:
+def add_image(client: Any, image_id: int, image_embedding: List[float], text_embedding: List[float],
+              tag_ids: List[int] = None) -> None:
     """Add image to clickhouse"""
-    row = [image_id, image_embedding, text_embedding]
-    data = [row]
-    client.insert('images', data, column_names=['id', 'image_embedding', 'text_embedding'])
+    add_images(client, [image_id], [image_embedding], [text_embedding], [tag_ids or []])
+
+def add_images(client: Any, image_ids: List[int], image_embeddings: List[List[float]], text_embeddings: List[List[float]] = None,
+               tag_ids: List[List[int]] = None) -> None:
+    """Add many images to clickhouse in one insert, tag_ids are the tags of every image"""
+    if text_embeddings is None:
+        text_embeddings = [[0]] * len(image_ids)
+    if tag_ids is None:
+        tag_ids = [[]] * len(image_ids)
+    data = [list(row) for row in zip(image_ids, image_embeddings, text_embeddings, tag_ids)]
+    client.insert('images', data, column_names=['id', 'image_embedding', 'text_embedding', 'tag_ids'])
+    index = get_index()
+    if index is not None:
+        index.add(image_ids, image_embeddings, tag_ids)
+    if settings.NEIGHBOURS_K > 0:
+        neighbours.schedule_add(client, image_ids, image_embeddings)
 
 def delete_image(client: Any, image_id: int) -> None:
     """Delete image from clickhouse"""
-    QUERY = f'DELETE FROM images WHERE id = {image_id}'
-    client.query(QUERY)
+    QUERY = 'ALTER TABLE images DELETE WHERE id = {id:Int64}'
+    client.command(QUERY, parameters={'id': image_id})
+    index = get_index()
+    if index is not None:
+        index.remove([image_id])
+    if settings.NEIGHBOURS_K > 0:
+        neighbours.schedule_remove(client, [image_id])
 
@@ -36,13 +36,95 @@ class Settings(BaseSettings):
     CLICKHOUSE_HOST: str
     CLICKHOUSE_PORT: int
     NUCLIO_API_URL: str = "http://localhost:32774"
+    NUCLIO_TIMEOUT: float = 30.0  # seconds, per inference call
+    NUCLIO_CONNECT_TIMEOUT: float = 5.0
+    NUCLIO_MAX_CONNECTIONS: int = 20
+    NUCLIO_MAX_KEEPALIVE: int = 10
+    NUCLIO_MAX_CONCURRENCY: int = 8  # in-flight inference calls per worker
+    # micro-batching of concurrent single embeddings, 0 window disables it
+    NUCLIO_BATCH_WINDOW_MS: float = 10.0
+    NUCLIO_MAX_BATCH: int = 16
+
+    # vector search backend: "clickhouse" (full scan), "numpy" (exact, memory-mapped) or "hnsw" (approximate)
+    VECTOR_BACKEND: str = "clickhouse"
+    # numpy backend keeps its matrix here, shared by all workers through the page cache
+    VECTOR_INDEX_DIR: str = "app/vector_index"
+    VECTOR_INDEX_CAPACITY: int = 10000  # initial rows, file doubles when full
+    VECTOR_INDEX_REBUILD: bool = False  # reload numpy index from clickhouse even if files exist
+    VECTOR_INDEX_MAX_TAGS: int = 32  # tag ids kept per row for filtered search in the numpy index
+    # clickhouse backend: first pass over a quantized copy ("none", "int8" or "bfloat16"),
+    # then exact rerank of the candidates. ANN index is used on servers that have it (25.1+).
+    # Both are approximate: a true neighbour missing from the first pass is never returned,
+    # so they are off by default and exact thresholds (duplicates) stay exact
+    CLICKHOUSE_QUANTIZATION: str = "none"
+    CLICKHOUSE_RERANK_CANDIDATES: int = 100
+    CLICKHOUSE_ANN_INDEX: bool = False
+    EMBEDDING_DIM: int = 640
+    # how many candidates to return when cosine_compare is called with limit=False
+    VECTOR_UNLIMITED_K: int = 1000
+    # similar-image endpoints: RERANK_COUNT results picked out of the RERANK_CANDIDATES nearest,
+    # "banded" (one per similarity band, RERANK_BAND_GAP apart) or "mmr" (RERANK_DIVERSITY 0..1)
+    RERANK_METHOD: str = "banded"
+    RERANK_CANDIDATES: int = 100
+    RERANK_COUNT: int = 5
+    RERANK_DIVERSITY: float = 0.5
+    RERANK_BAND_GAP: float = 0.015
+    RERANK_MIN_SIMILARITY: float = 0.65
+    # upload tag suggestions: SUGGEST_NEIGHBOURS nearest images vote, weighted by similarity,
+    # tags with at least SUGGEST_MIN_VOTE of the votes are suggested
+    SUGGEST_NEIGHBOURS: int = 5
+    SUGGEST_MIN_VOTE: float = 0.3
+    # zero-shot tag prediction at upload: image embedding against text embeddings of all tags
+    TAG_PREDICT: bool = True
+    TAG_PREDICT_TOP_N: int = 5
+    TAG_PREDICT_MIN_CONFIDENCE: float = 0.05
+    TAG_PREDICT_LOGIT_SCALE: float = 100.0  # CLIP logit scale
+    TAG_PROMPT_TEMPLATE: str = "a photo of {}"
+    TAG_INDEX_REFRESH_SECONDS: int = 60  # picks up tags created by other processes
+    # neighbours stored per image for /images/{id}/similar, 0 disables the neighbour table
+    NEIGHBOURS_K: int = 100
+    NEIGHBOURS_REVERSE_K: int = 400  # nearest images of a new image whose lists it may enter
+    NEIGHBOURS_BATCH: int = 64  # images per background update and per clickhouse neighbour search
+    HNSW_M: int = 16  # graph degree, higher = better recall, more memory
+    HNSW_EF_CONSTRUCTION: int = 200
+    HNSW_EF_SEARCH: int = 64  # query beam width, higher = better recall, slower
+    HNSW_MAX_ELEMENTS: int = 100000  # initial capacity, index grows on demand
+    HNSW_EXACT_SEARCH_MAX: int = 10000  # when the graph walk fails, up to this many images are compared exactly
     DATABASE_URI: Optional[PostgresDsn] = None
+    # connection pool of each engine (sync and asyncpg) in every worker process
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: float = 30.0  # seconds to wait for a free connection
+    DB_POOL_RECYCLE: int = 1800  # seconds, reconnect older connections
     MESSAGE_STREAM_DELAY: int = 1  # second
     MESSAGE_STREAM_RETRY_TIMEOUT: int = 15000  # milisecond
 
     REDIS_URI: str = "redis://redis:6379"
     CACHE_EXPIRE: int = 30
+    # image listings are always paged, by (created_at, id) cursor
+    PAGE_SIZE: int = 50
+    MAX_PAGE_SIZE: int = 200
+    # listing totals: planner estimate of the image table above the threshold, exact count below,
+    # both (and tag filter counts) cached in process
+    EXACT_COUNT_THRESHOLD: int = 10000
+    COUNT_CACHE_TTL: int = 60  # seconds
+    COUNT_CACHE_SIZE: int = 1024
+    # text query -> embedding cache, in-process LRU in front of redis
+    CLIP_MODEL_ID: str = "M-BERT-Distil-40+RN50x4"
+    EMBEDDING_CACHE_SIZE: int = 1024  # entries kept in process
+    EMBEDDING_CACHE_TTL: int = 86400  # seconds
+    # token subject -> resolved user, in-process (short) in front of redis, cleared by user updates
+    PRINCIPAL_CACHE_TTL: int = 300  # seconds
+    PRINCIPAL_CACHE_LOCAL_TTL: int = 10  # seconds
+    PRINCIPAL_CACHE_SIZE: int = 4096  # entries kept in process
     UPLOAD_FOLDER: str = "app/uploads"
+    # bulk upload pipeline
+    INGEST_CONCURRENCY: int = 8  # files in storage/thumbnail stages at once
+    INGEST_BATCH_SIZE: int = 16  # files per embedding call and db/clickhouse write
+    # asynchronous uploads, jobs are queued in redis
+    UPLOAD_WORKERS: int = 2  # workers per api process, 0 leaves jobs to `python -m app.upload_worker`
+    UPLOAD_JOB_TTL: int = 86400  # seconds a job and its result are kept
+    UPLOAD_JOB_STALE_SECONDS: int = 600  # a job processing longer than this is considered lost and queued again
 
     RESOURCE_ENDPOINT: str = "http://localhost:9000"
     ACCESS_SECRET: str
@@ -50,8 +132,14 @@ class Settings(BaseSettings):
     REGION: str
     DEFAULT_BUCKET: str
     S3_ENDPOINT: str = "https://localhost:9000"
+    S3_PART_SIZE: int = 10 * 1024 * 1024  # multipart chunk, bounds memory per upload
 
     IMGPROXY_HOST: str = "http://localhost:50200"
+    # "local" renders thumbnails in a process pool (imgproxy is the fallback), "imgproxy" always uses imgproxy
+    IMAGE_PROCESSING: str = "local"
+    IMAGE_WORKERS: int = 2
+    # bigger originals are decoded from the upload stream in a thread instead of being copied to the pool
+    IMAGE_POOL_MAX_BYTES: int = 8 * 1024 * 1024
 
     @validator("DATABASE_URI", pre=True)
     def assemble_db_connection(cls, v: Optional[str], values: Dict[str, Any]) -> Any:
@@ -66,6 +154,10 @@ class Settings(BaseSettings):
     ALGORITHM: str = "HS256"
     SECRET_KEY: str
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 10080 #10080
+    # bcrypt cost factor, stored hashes with another cost are rehashed on login
+    BCRYPT_ROUNDS: int = 12
+    PASSWORD_HASH_WORKERS: int = 2  # threads hashing passwords, bounds login / signup throughput
+    PASSWORD_HASH_MAX_PENDING: int = 64  # queued + running hashes, more are answered with 503
     ALLOWED_FILE_TYPES: List[str] = ["image/jpeg", "image/png", "image/jpg", "image/gif", "image/webp"]
 
     class Config:
@@ -0,0 +1,149 @@
+"""crud for the async def endpoints, on an AsyncSession (asyncpg).
+
+Lookups are plain awaited selects. Functions with paging, count caching or
+writes run the sync implementation from `crud` through `run_sync`: it
+executes on the event loop with asyncpg underneath, so it does not block
+other requests and there is still a single implementation of it.
+"""
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+
+from typing import Dict, List, Union
+
+from app.core import crud
+from app.cache.principal_cache import get_principal_cache
+from app.utils.passwords import get_password_hasher
+from app.models import db_models, models
+from app.schemas import response_schemas, request_schemas
+
+
+async def get_user(db: AsyncSession, email: Union[str, None]) -> Union[models.UserInDB, None]:
+    user = (await db.execute(
+        select(db_models.User).where(db_models.User.email == email)
+    )).scalar_one_or_none()
+    if user is None:
+        return None
+    return models.UserInDB(
+        id=user.id,
+        email=user.email,
+        username=user.username,
+        hashed_password=user.hashed_password,
+    )
+
+async def create_user(db: AsyncSession, user: request_schemas.UserCreate) -> response_schemas.User:
+    """raises PasswordHashBusy when the password hashing queue is full"""
+    hashed_password = await get_password_hasher().hash(user.password)
+    return await db.run_sync(crud.create_user, user, hashed_password)
+
+async def update_password_hash(db: AsyncSession, user_id: int, hashed_password: str) -> None:
+    await db.execute(
+        update(db_models.User).where(db_models.User.id == user_id).values(hashed_password=hashed_password)
+    )
+    await db.commit()
+
+async def user_update(db: AsyncSession,
+                      user: request_schemas.UserUpdate,
+                      current_user: response_schemas.User
+                      ) -> Union[response_schemas.User, None]:
+    hashed_password = await get_password_hasher().hash(user.password) if user.password else None
+    updated = await db.run_sync(crud.user_update, user, current_user, hashed_password)
+    principal_cache = get_principal_cache()
+    if principal_cache is not None:
+        # tokens carry the email, a changed email must not resolve to the old principal
+        await principal_cache.invalidate(current_user.email, *([updated.email] if updated else []))
+    return updated
+
+async def get_all_tags(db: AsyncSession) -> response_schemas.TagList:
+    tags = (await db.execute(select(db_models.Tag))).scalars().all()
+    tags = [response_schemas.Tag.model_validate(tag) for tag in tags]
+    return response_schemas.TagList(
+        count=len(tags),
+        tags=tags,
+    )
+
+async def get_tag_ids(db: AsyncSession, tag_names: List[str]) -> Dict[str, int]:
+    """ids of existing tags by name"""
+    rows = await db.execute(
+        select(db_models.Tag.id, db_models.Tag.name).where(db_models.Tag.name.in_(tag_names))
+    )
+    return {name: tag_id for tag_id, name in rows.all()}
+
+async def find_images(db: AsyncSession, **filters) -> response_schemas.TaggedImageList:
+    """crud.find_images, raises ValueError on an invalid cursor"""
+    return await db.run_sync(lambda session: crud.find_images(session, **filters))
+
+async def get_all_images(db: AsyncSession, on_page: int = None, cursor: str = None) -> response_schemas.ImageListResponse:
+    return await db.run_sync(crud.get_all_images, on_page, cursor)
+
+async def get_images_by_ids(db: AsyncSession, image_ids: List[int]) -> response_schemas.ImageList:
+    images = (await db.execute(
+        select(db_models.Image).where(db_models.Image.id.in_(image_ids))
+    )).scalars().all()
+    images = [response_schemas.Image.model_validate(image) for image in images]
+    return response_schemas.ImageList(
+        count=len(images),
+        images=images,
+    )
+
+async def get_tagged_images_by_ids(db: AsyncSession, image_ids: List[int]) -> response_schemas.TaggedImageList:
+    """images with their tags (loaded like find_images does) in the order of image_ids"""
+    images = (await db.execute(
+        select(db_models.Image)
+        .where(db_models.Image.id.in_(image_ids))
+        .options(selectinload(db_models.Image.tags))
+    )).scalars().all()
+    by_id = {image.id: response_schemas.TaggedImage.model_validate(image) for image in images}
+    images = [by_id[image_id] for image_id in image_ids if image_id in by_id]
+    return response_schemas.TaggedImageList(
+        count=len(images),
+        images=images,
+    )
+
+async def get_image_by_id(db: AsyncSession, image_id: int) -> Union[response_schemas.Image, None]:
+    image = await db.get(db_models.Image, image_id)
+    if image is None:
+        return None
+    return response_schemas.Image.model_validate(image)
+
+async def get_image_by_hash(db: AsyncSession, content_hash: str) -> Union[response_schemas.Image, None]:
+    """first stored image with exactly the same file content"""
+    image = (await db.execute(
+        select(db_models.Image)
+        .where(db_models.Image.content_hash == content_hash)
+        .order_by(db_models.Image.id)
+        .limit(1)
+    )).scalar_one_or_none()
+    if image is None:
+        return None
+    return response_schemas.Image.model_validate(image)
+
+async def get_all_user_stores(db: AsyncSession, user: response_schemas.User) -> response_schemas.UserStoreList:
+    stores = (await db.execute(
+        select(db_models.UserStore).where(db_models.UserStore.user_id == user.id)
+    )).scalars().all()
+    return response_schemas.UserStoreList(
+        count=len(stores),
+        user_stores=[response_schemas.UserStore.model_validate(store) for store in stores],
+    )
+
+async def create_user_store(db: AsyncSession, user: response_schemas.User, store_name: str) -> response_schemas.UserStore:
+    return await db.run_sync(crud.create_user_store, user, store_name)
+
+async def update_user_store(db: AsyncSession, user: response_schemas.User, store_id: int, store_name: str) -> response_schemas.UserStore:
+    return await db.run_sync(crud.update_user_store, user, store_id, store_name)
+
+async def add_image_to_user_store(db: AsyncSession, user: response_schemas.User, store_id: int, image_id: int) -> Dict:
+    return await db.run_sync(crud.add_image_to_user_store, user, store_id, image_id)
+
+async def get_all_images_from_user_store(db: AsyncSession, user: response_schemas.User, store_id: int) -> response_schemas.ImageList:
+    images = (await db.execute(
+        select(db_models.Image)
+        .join(db_models.UserImageStore, db_models.UserImageStore.image_id == db_models.Image.id)
+        .where(db_models.UserImageStore.store_id == store_id)
+    )).scalars().all()
+    images = [response_schemas.Image.model_validate(image) for image in images]
+    return response_schemas.ImageList(
+        count=len(images),
+        images=images,
+    )
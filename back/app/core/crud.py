@@ -1,5 +1,6 @@
-from sqlalchemy import update
-from sqlalchemy.orm import Session
+from sqlalchemy import func, select, text, tuple_, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session, selectinload
 from sqlalchemy.exc import NoResultFound
 
 from datetime import datetime
@@ -9,11 +10,24 @@ from typing import Union
 from app.models import db_models, models
 from app.schemas import response_schemas, request_schemas
 from app.config import log
-from app.utils.token import get_password_hash
+from app.config import settings
 from app.utils.next_week import get_next_week_dates
+from app.utils.cursor import decode_cursor, encode_cursor
 import os
+import time
 
-from typing import List
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+# search filter -> (image column, json key), matched with jsonb containment
+METADATA_FILTERS = {
+    "camera": ("exif", "Model"),
+    "region": ("metainfo", "region"),
+    "author": ("metainfo", "author"),
+    "license": ("metainfo", "license"),
+}
+
+# count query key -> (expires_at, count)
+CountCache: Dict[Any, Tuple[float, int]] = {}
 
 
 def get_user(db: Session, email: Union[str, None]) -> Union[models.UserInDB, None]:
@@ -47,11 +61,12 @@ def check_if_user_admin(db: Session, user: response_schemas.User) -> bool:
     except NoResultFound:
         return False
 
-def create_user(db: Session, user: request_schemas.UserCreate) -> response_schemas.User:
+def create_user(db: Session, user: request_schemas.UserCreate, hashed_password: str) -> response_schemas.User:
+    """hashed_password comes from the password hasher pool (async_crud.create_user)"""
     db_user = db_models.User(
         email=user.email,
         username=user.username,
-        hashed_password=get_password_hash(user.password),
+        hashed_password=hashed_password,
     )
     db.add(db_user)
     db.commit()
@@ -64,8 +79,10 @@ def create_user(db: Session, user: request_schemas.UserCreate) -> response_schem
 
 def user_update(db: Session,
                 user: request_schemas.UserUpdate,
-                current_user: response_schemas.User
+                current_user: response_schemas.User,
+                hashed_password: str = None,
                 ) -> Union[response_schemas.User, None]:
+    """hashed_password of user.password, from the password hasher pool (async_crud.user_update)"""
     try:
         db_user = (
             db.query(db_models.User)
@@ -79,7 +96,7 @@ def user_update(db: Session,
         if user.username:
             db_user.username = user.username
         if user.password:
-            db_user.hashed_password = get_password_hash(user.password)
+            db_user.hashed_password = hashed_password
         db.commit()
         db.refresh(db_user)
 
@@ -96,8 +113,54 @@ def user_update(db: Session,
     except NoResultFound:
         return None
 
-def create_image(db: Session, image: request_schemas.ImageCreate) -> response_schemas.Image:
-    """create image in db. assign tags to image. create tags if not exist"""
+def upsert_tags(db: Session, tag_names: List[str]) -> Dict[str, int]:
+    """ids of tags by name, missing tags are created. one INSERT ... ON CONFLICT, no commit
+
+    Rows that already existed (or were inserted by a concurrent upload) are not
+    returned by the insert and are read back with one SELECT.
+    """
+    tag_names = list(dict.fromkeys(tag_names))
+    if not tag_names:
+        return {}
+    now = datetime.now()
+    inserted = db.execute(
+        pg_insert(db_models.Tag)
+        .values([{"name": tag_name, "created_at": now} for tag_name in tag_names])
+        .on_conflict_do_nothing(index_elements=[db_models.Tag.name])
+        .returning(db_models.Tag.id, db_models.Tag.name)
+    ).all()
+    tag_ids = {name: tag_id for tag_id, name in inserted}
+    missing = [tag_name for tag_name in tag_names if tag_name not in tag_ids]
+    if missing:
+        tag_ids.update(
+            (name, tag_id)
+            for tag_id, name in db.execute(
+                select(db_models.Tag.id, db_models.Tag.name).where(db_models.Tag.name.in_(missing))
+            ).all()
+        )
+    return tag_ids
+
+def link_tags(db: Session, image_tags: Dict[int, List[str]]) -> Dict[str, int]:
+    """bulk insert image_tag rows for {image_id: tag names}, no commit. returns tag ids by name"""
+    tag_ids = upsert_tags(db, [tag_name for tag_names in image_tags.values() for tag_name in tag_names])
+    rows = [
+        {"image_id": image_id, "tag_id": tag_ids[tag_name]}
+        for image_id, tag_names in image_tags.items()
+        for tag_name in dict.fromkeys(tag_names)
+    ]
+    if rows:
+        db.execute(pg_insert(db_models.ImageTag).values(rows).on_conflict_do_nothing())
+    return tag_ids
+
+def tagged_image(db_image: db_models.Image, tag_names: List[str], tag_ids: Dict[str, int]) -> response_schemas.TaggedImage:
+    """response of a just created image, tags come from link_tags instead of a lazy load"""
+    return response_schemas.TaggedImage(
+        **response_schemas.Image.model_validate(db_image).model_dump(),
+        tags=[response_schemas.Tag(id=tag_ids[tag_name], name=tag_name) for tag_name in dict.fromkeys(tag_names)],
+    )
+
+def create_image(db: Session, image: request_schemas.ImageCreate) -> response_schemas.TaggedImage:
+    """create image in db. assign tags to image. create tags if not exist. one transaction"""
     try:
         db_image = db_models.Image(
             original_file_path=image.original_file_path,
@@ -105,40 +168,43 @@ def create_image(db: Session, image: request_schemas.ImageCreate) -> response_sc
             description=image.description,
             exif=image.exif,
             metainfo=image.metainfo,
+            content_hash=image.content_hash,
+            phash=image.phash,
         )
         db.add(db_image)
+        db.flush()
+        tag_ids = link_tags(db, {db_image.id: image.tags})
+        created = tagged_image(db_image, image.tags, tag_ids)
         db.commit()
-        db.refresh(db_image)
-
-        tags = []
-        for tag_name in image.tags:
-            try:
-                db_tag = (
-                    db.query(db_models.Tag)
-                    .filter(
-                        db_models.Tag.name == tag_name,
-                    )
-                    .one()
-                )
-            except NoResultFound:
-                db_tag = db_models.Tag(
-                    name=tag_name,
-                )
-                db.add(db_tag)
-                db.commit()
-                db.refresh(db_tag)
-            tags.append(db_tag)
-        db_image.tags = tags
-        db.commit()
-        db.refresh(db_image)
 
-        db_image = response_schemas.Image.model_validate(db_image)
+        log.info(f"Created image: {created}")
+        return created
 
-        log.info(f"Created image: {db_image}")
-        return db_image
+    except Exception:
+        db.rollback()
+        raise
 
-    except NoResultFound:
-        return None
+def create_images(db: Session, images: List[request_schemas.ImageCreate]) -> List[response_schemas.TaggedImage]:
+    """create many images with their tags, flushed but not committed: the caller commits once the vectors are stored"""
+    db_images = [
+        db_models.Image(
+            original_file_path=image.original_file_path,
+            thumbnail_file_path=image.thumbnail_file_path,
+            description=image.description,
+            exif=image.exif,
+            metainfo=image.metainfo,
+            content_hash=image.content_hash,
+            phash=image.phash,
+        )
+        for image in images
+    ]
+    db.add_all(db_images)
+    db.flush()
+    tag_ids = link_tags(db, {db_image.id: image.tags for db_image, image in zip(db_images, images)})
+    created = [tagged_image(db_image, image.tags, tag_ids) for db_image, image in zip(db_images, images)]
+
+    log.info(f"Created {len(created)} images")
+    return created
 
 def get_all_tags(db: Session) -> response_schemas.TagList:
     try:
@@ -157,26 +223,108 @@ def get_all_tags(db: Session) -> response_schemas.TagList:
             tags=[],
         )
 
-def get_images_with_tags(db: Session, tags: List[str]) -> response_schemas.ImageList:
-    try:
-        images = (
-            db.query(db_models.Image)
-            .join(db_models.Image.tags)
-            .filter(
-                db_models.Tag.name.in_(tags),
-            )
-            .all()
-        )
-        images = [response_schemas.Image.model_validate(image) for image in images]
-        return response_schemas.ImageList(
-            count=len(images),
-            images=images,
+def keyset_page(query: Any, on_page: int = None, cursor: str = None) -> Tuple[List[db_models.Image], Optional[str]]:
+    """one page of an image query newest first, (images, next cursor or None)
+
+    Rows after the cursor are found by seeking the (created_at, id) index,
+    cost does not grow with the depth of the page.
+    """
+    on_page = min(on_page or settings.PAGE_SIZE, settings.MAX_PAGE_SIZE)
+    if cursor is not None:
+        created_at, image_id = decode_cursor(cursor)
+        query = query.filter(
+            tuple_(db_models.Image.created_at, db_models.Image.id) < tuple_(created_at, image_id)
         )
-    except NoResultFound:
-        return response_schemas.ImageList(
-            count=0,
-            images=[],
+    images = (
+        query
+        .order_by(db_models.Image.created_at.desc(), db_models.Image.id.desc())
+        .limit(on_page + 1)
+        .all()
+    )
+    if len(images) <= on_page:
+        return images, None
+    last = images[on_page - 1]
+    return images[:on_page], encode_cursor(last.created_at, last.id)
+
+def cached_count(key: Any, count: Callable[[], int]) -> int:
+    """count() cached in process for COUNT_CACHE_TTL seconds"""
+    now = time.monotonic()
+    hit = CountCache.get(key)
+    if hit is not None and hit[0] > now:
+        return hit[1]
+    value = count()
+    CountCache.pop(key, None)
+    if len(CountCache) >= settings.COUNT_CACHE_SIZE:
+        CountCache.pop(next(iter(CountCache)))
+    CountCache[key] = (now + settings.COUNT_CACHE_TTL, value)
+    return value
+
+def estimate_image_count(db: Session) -> int:
+    """planner estimate of the image table size, exact count for small tables"""
+    def count() -> int:
+        estimate = db.execute(text("SELECT reltuples::bigint FROM pg_class WHERE oid = 'image'::regclass")).scalar()
+        # reltuples is -1 until the table is first analyzed
+        if estimate is None or estimate < settings.EXACT_COUNT_THRESHOLD:
+            return db.query(func.count(db_models.Image.id)).scalar()
+        return int(estimate)
+    return cached_count("images", count)
+
+def get_tag_ids(db: Session, tag_names: List[str]) -> Dict[str, int]:
+    """ids of existing tags by name"""
+    return {
+        name: tag_id
+        for tag_id, name in db.execute(
+            select(db_models.Tag.id, db_models.Tag.name).where(db_models.Tag.name.in_(tag_names))
+        ).all()
+    }
+
+def metadata_filters(metadata: Dict[str, str]) -> List[Any]:
+    """jsonb containment clauses for METADATA_FILTERS, served by the GIN indexes"""
+    clauses = []
+    for name, value in metadata.items():
+        column, key = METADATA_FILTERS[name]
+        clauses.append(getattr(db_models.Image, column).contains({key: value}))
+    return clauses
+
+def find_images(db: Session, tags: List[str] = None, match: str = "any", metadata: Dict[str, str] = None,
+                on_page: int = None, cursor: str = None, image_ids: List[int] = None) -> response_schemas.TaggedImageList:
+    """page of distinct images filtered by tags and exif / metainfo, newest first, tags loaded in one extra query
+
+    image ids of `tags` are resolved in a subquery grouped by image on the
+    image_tag(tag_id) index, `all` keeps images whose group has every requested
+    tag. `metadata` ({"camera": ..., "author": ...}, see METADATA_FILTERS) must
+    match exactly. `image_ids` narrows the result further (e.g. to text search hits).
+    """
+    metadata = {name: value for name, value in (metadata or {}).items() if value is not None}
+    query = db.query(db_models.Image)
+    tag_names = list(dict.fromkeys(tags or []))
+    if tag_names:
+        matching = (
+            select(db_models.ImageTag.image_id)
+            .join(db_models.Tag, db_models.Tag.id == db_models.ImageTag.tag_id)
+            .where(db_models.Tag.name.in_(tag_names))
+            .group_by(db_models.ImageTag.image_id)
         )
+        if match == "all":
+            matching = matching.having(func.count() == len(tag_names))
+        query = query.filter(db_models.Image.id.in_(matching))
+    if metadata:
+        query = query.filter(*metadata_filters(metadata))
+    if image_ids is not None:
+        query = query.filter(db_models.Image.id.in_(image_ids))
+    images, next_cursor = keyset_page(query.options(selectinload(db_models.Image.tags)), on_page, cursor)
+    total = query.with_entities(func.count(db_models.Image.id))
+    if image_ids is None:
+        key = ("images", match, tuple(sorted(tag_names)), tuple(sorted(metadata.items())))
+        total_count = cached_count(key, total.scalar)
+    else:
+        total_count = total.scalar()
+    return response_schemas.TaggedImageList(
+        count=total_count,
+        images=[response_schemas.TaggedImage.model_validate(image) for image in images],
+        has_more=next_cursor is not None,
+        next_cursor=next_cursor,
+    )
 
 def get_images_by_ids(db: Session, image_ids: List[int]) -> response_schemas.ImageList:
     try:
@@ -199,32 +347,15 @@ def get_images_by_ids(db: Session, image_ids: List[int]) -> response_schemas.Ima
             images=[],
         )
 
-def get_all_images(db: Session, on_page: int, page_num: int) -> response_schemas.ImageListResponse:
-    try:
-        if on_page is not None and page_num is not None:
-            images = (
-                db.query(db_models.Image)
-                .limit(on_page)
-                .offset((page_num - 1) * on_page)
-                .all()
-            )
-        else:
-            images = (
-                db.query(db_models.Image)
-                .all()
-            )
-        total_count = len(images)
-        images_list = [response_schemas.Image.model_validate(image) for image in images]
-        return response_schemas.ImageListResponse(
-            count=total_count,
-            images=images_list,
-            has_more = True if (page_num*on_page) < total_count else False
-        )
-    except NoResultFound:
-        return response_schemas.ImageList(
-            count=0,
-            images=[],
-        )
+def get_all_images(db: Session, on_page: int = None, cursor: str = None) -> response_schemas.ImageListResponse:
+    """page of all images newest first, count is the (estimated) size of the image table"""
+    images, next_cursor = keyset_page(db.query(db_models.Image), on_page, cursor)
+    return response_schemas.ImageListResponse(
+        count=estimate_image_count(db),
+        images=[response_schemas.Image.model_validate(image) for image in images],
+        has_more=next_cursor is not None,
+        next_cursor=next_cursor,
+    )
 
 def get_image_by_id(db: Session, image_id: int) -> Union[response_schemas.Image, None]:
     try:
@@ -240,6 +371,43 @@ def get_image_by_id(db: Session, image_id: int) -> Union[response_schemas.Image,
     except NoResultFound:
         return None
 
+def get_image_by_hash(db: Session, content_hash: str) -> Union[response_schemas.Image, None]:
+    """first stored image with exactly the same file content"""
+    image = (
+        db.query(db_models.Image)
+        .filter(
+            db_models.Image.content_hash == content_hash,
+        )
+        .order_by(db_models.Image.id)
+        .first()
+    )
+    if image is None:
+        return None
+    return response_schemas.Image.model_validate(image)
+
+def get_images_by_hashes(db: Session, content_hashes: List[str]) -> Dict[str, response_schemas.Image]:
+    """first stored image per content hash, hashes without image are left out"""
+    images = (
+        db.query(db_models.Image)
+        .filter(
+            db_models.Image.content_hash.in_(content_hashes),
+        )
+        .order_by(db_models.Image.id.desc())
+        .all()
+    )
+    # descending order, so the oldest image of each hash is written last
+    return {image.content_hash: response_schemas.Image.model_validate(image) for image in images}
+
+def get_tag_id_set(db: Session) -> Set[int]:
+    """ids of all tags"""
+    return set(db.execute(select(db_models.Tag.id)).scalars().all())
+
+def get_tags_by_ids(db: Session, tag_ids: List[int]) -> List[response_schemas.Tag]:
+    tags = db.execute(
+        select(db_models.Tag).where(db_models.Tag.id.in_(tag_ids)).order_by(db_models.Tag.id)
+    ).scalars().all()
+    return [response_schemas.Tag.model_validate(tag) for tag in tags]
+
 def get_tags_of_image(db: Session, image_id: int) -> response_schemas.TagList:
     try:
         tags = (
@@ -261,6 +429,21 @@ def get_tags_of_image(db: Session, image_id: int) -> response_schemas.TagList:
             tags=[],
         )
 
+def get_neighbourhood(db: Session, image_ids: List[int]) -> Dict[int, Tuple[str, List[response_schemas.Tag]]]:
+    """image id -> (thumbnail path, tags) of all given images in one query"""
+    rows = db.execute(
+        select(db_models.Image.id, db_models.Image.thumbnail_file_path, db_models.Tag.id, db_models.Tag.name)
+        .outerjoin(db_models.ImageTag, db_models.ImageTag.image_id == db_models.Image.id)
+        .outerjoin(db_models.Tag, db_models.Tag.id == db_models.ImageTag.tag_id)
+        .where(db_models.Image.id.in_(image_ids))
+    ).all()
+    neighbourhood: Dict[int, Tuple[str, List[response_schemas.Tag]]] = {}
+    for image_id, thumbnail_path, tag_id, tag_name in rows:
+        _, tags = neighbourhood.setdefault(image_id, (thumbnail_path, []))
+        if tag_id is not None:
+            tags.append(response_schemas.Tag(id=tag_id, name=tag_name))
+    return neighbourhood
+
 def delete_image(db: Session, image_id: int) -> None:
     """delete image from db. delte from ImageTag table as well"""
     try:
@@ -1,7 +1,8 @@
 import time
 from typing import Any
 
-from sqlalchemy import create_engine, Engine
+from sqlalchemy import create_engine, make_url, Engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncEngine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.exc import OperationalError as sqlalchemyOpError
 from psycopg2 import OperationalError as psycopg2OpError
@@ -12,6 +13,29 @@ from app.models.db_models import Base
 
 engine: Engine
 SessionLocal: Any
+# asyncpg engine for the async def endpoints, same database
+async_engine: AsyncEngine
+AsyncSessionLocal: Any
+
+
+def pool_options() -> dict:
+    return dict(
+        pool_pre_ping=True,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+    )
+
+
+def connect_async_db():
+    """engine is created lazily, connections are opened by the first query"""
+    global async_engine
+    global AsyncSessionLocal
+    url = make_url(str(settings.DATABASE_URI)).set(drivername="postgresql+asyncpg")
+    async_engine = create_async_engine(url, **pool_options())
+    # loaded attributes stay readable after commit, nothing is lazy loaded outside the session
+    AsyncSessionLocal = async_sessionmaker(bind=async_engine, expire_on_commit=False)
 
 
 def connect_db():
@@ -20,7 +44,7 @@ def connect_db():
     try:
         engine = create_engine(
             str(settings.DATABASE_URI),
-            pool_pre_ping=True,
+            **pool_options(),
         )
     except Exception as e:
         log.error(e)
@@ -46,5 +70,6 @@ def init_db():
         else:
             connected = True
             update_db()
+            connect_async_db()
             log.info("initialized db")
     return SessionLocal
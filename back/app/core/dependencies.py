@@ -1,5 +1,5 @@
 from app.core.database import SessionLocal
-from passlib.context import CryptContext
+from app.core import database
 from fastapi.security import OAuth2PasswordBearer
 
 
@@ -14,9 +14,13 @@ def get_db():
         db.close()
 
 
+async def get_async_db():
+    async with database.AsyncSessionLocal() as db:
+        yield db
+
+
 # endregion
 
-pwd_context = CryptContext(schemes=["bcrypt"])
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/user/token")
 alternate_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/user/token", auto_error=False)
 # endregion
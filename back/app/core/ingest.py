@@ -0,0 +1,371 @@
+from sqlalchemy.orm import Session
+
+from app.config import log
+from app.config import settings
+from app.schemas import response_schemas, request_schemas
+from app.click.vector_utils import add_image, add_images, delete_image, get_image_vector, neighbourhood
+from app.click.tag_index import get_tag_index
+from app.core import crud
+from app.nuclio.client import NuclioClient
+from app.utils import imaging
+from app.utils.json_safe import json_safe
+from minio import Minio
+from uuid import uuid4
+from base64 import urlsafe_b64encode, b64encode
+from dataclasses import dataclass, field
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple
+from io import BytesIO
+from PIL import Image
+from PIL import ExifTags
+import asyncio
+import hashlib
+import requests
+
+
+class IngestError(Exception):
+    """One stage of the upload pipeline failed for a file"""
+
+
+@dataclass
+class IngestFile:
+    """One photo to ingest, file is a readable binary stream of `size` bytes"""
+    filename: str
+    content_type: str
+    file: BinaryIO
+    size: int
+    description: str = ""
+    metainfo: Dict = field(default_factory=dict)
+    tags: List[str] = field(default_factory=list)
+
+
+@dataclass
+class PreparedFile:
+    """File after storage stages, ready for embedding"""
+    index: int
+    source: IngestFile
+    full_path: str
+    thumbnail_path: str
+    model_ready: bytes
+    exif: Dict
+    content_hash: str
+    phash: Optional[int] = None
+
+
+def base64UrlEncode(data):
+    return urlsafe_b64encode(data).rstrip(b'=')
+
+
+class HashingReader:
+    """Read-through wrapper hashing everything minio reads from the stream"""
+
+    def __init__(self, file: BinaryIO) -> None:
+        self.file = file
+        self.sha256 = hashlib.sha256()
+
+    def read(self, size: int = -1) -> bytes:
+        chunk = self.file.read(size)
+        self.sha256.update(chunk)
+        return chunk
+
+
+def file_sha256(file: BinaryIO, chunk_size: int = 1024 * 1024) -> str:
+    """sha256 hex of a seekable stream, read in chunks"""
+    file.seek(0)
+    sha256 = hashlib.sha256()
+    for chunk in iter(lambda: file.read(chunk_size), b""):
+        sha256.update(chunk)
+    file.seek(0)
+    return sha256.hexdigest()
+
+
+def store_original(client: Minio, file: BinaryIO, size: int, filename: str) -> Tuple[str, str, str]:
+    """save file to minio with uuid as object name, returns (object_name, full_path, sha256)
+
+    The stream is read once, in part_size chunks (multipart upload for big files),
+    and hashed on the way.
+    """
+    object_name = f"{uuid4()}.{filename.split('.')[-1]}"
+    file.seek(0)
+    reader = HashingReader(file)
+    client.put_object(settings.DEFAULT_BUCKET, object_name, reader, size, part_size=settings.S3_PART_SIZE)
+    full_path = f"{settings.S3_ENDPOINT}/{settings.DEFAULT_BUCKET}/{object_name}"
+    return object_name, full_path, reader.sha256.hexdigest()
+
+
+def render_imgproxy(object_name: str) -> Tuple[bytes, bytes]:
+    """thumbnail (fit 700x700) and model ready (force 288x288) png of stored object via imgproxy"""
+    s3_url = f"s3://{settings.DEFAULT_BUCKET}/{object_name}"
+    imgproxy_objeect_name_base = base64UrlEncode(s3_url.encode('utf-8')).decode('utf-8')
+    thumbnail_path_imgproxy = f"{settings.IMGPROXY_HOST}/unsafe/rs:fit:700:700/{imgproxy_objeect_name_base}.png"
+    model_ready_imgproxy = f"{settings.IMGPROXY_HOST}/unsafe/rs:force:288:288/{imgproxy_objeect_name_base}.png"
+    response = requests.get(thumbnail_path_imgproxy)
+    if response.status_code != 200:
+        raise IngestError("Failed to get thumbnail")
+    thumbnail = response.content
+    response = requests.get(model_ready_imgproxy)
+    if response.status_code != 200:
+        raise IngestError("Failed to get model_ready image")
+    return thumbnail, response.content
+
+
+def render_thumbnails(object_name: str, file: BinaryIO, size: int) -> Tuple[bytes, bytes]:
+    """thumbnail and model ready png, decoded locally in the image pool or via imgproxy"""
+    if settings.IMAGE_PROCESSING == "local":
+        try:
+            return imaging.render(file, size, settings.IMAGE_POOL_MAX_BYTES)
+        except Exception as ex:
+            log.warning(f"local thumbnail rendering of {object_name} failed, using imgproxy {ex!r}")
+    return render_imgproxy(object_name)
+
+
+def store_thumbnail(client: Minio, object_name: str, thumbnail: bytes) -> str:
+    thumbnail_object_name = f"t{object_name.split('.')[0]}-thumb.png"
+    client.put_object(settings.DEFAULT_BUCKET, thumbnail_object_name, BytesIO(thumbnail), len(thumbnail))
+    return f"{settings.S3_ENDPOINT}/{settings.DEFAULT_BUCKET}/{thumbnail_object_name}"
+
+
+def read_exif(file: BinaryIO) -> Dict:
+    """json safe exif of the image, Pillow reads the metadata from the stream, pixels are not decoded"""
+    file.seek(0)
+    try:
+        img = Image.open(file)
+        raw = img._getexif() if hasattr(img, "_getexif") else dict(img.getexif())
+    except Exception as ex:
+        log.debug(f"no exif {ex!r}")
+        raw = None
+    finally:
+        file.seek(0)
+    return json_safe({ExifTags.TAGS[k]: v for k, v in (raw or {}).items() if k in ExifTags.TAGS})
+
+
+def known_embedding(session: Session, click_client: Any,
+                    content_hash: str) -> Tuple[Optional[response_schemas.Image], Optional[List[float]]]:
+    """(stored image with the same content, its embedding) or (None, None)
+
+    One indexed postgres lookup, the vector comes from the vector index / clickhouse by id.
+    """
+    duplicate = crud.get_image_by_hash(session, content_hash)
+    if duplicate is None:
+        return None, None
+    embed = stored_embedding(click_client, duplicate)
+    if embed is None:
+        return None, None
+    return duplicate, embed
+
+
+def stored_embedding(click_client: Any, image: response_schemas.Image) -> Optional[List[float]]:
+    """embedding of a stored image, None if it has no vector"""
+    try:
+        return list(get_image_vector(click_client, image.id))
+    except IndexError:
+        log.warning(f"image {image.id} has no vector, embedding it again")
+        return None
+
+
+def suggest_tags(neighbours: List, tags_of: Dict[int, List[response_schemas.Tag]]) -> response_schemas.TagList:
+    """tags voted for by the neighbours, every neighbour votes with its similarity
+
+    A tag is suggested when its share of all votes reaches SUGGEST_MIN_VOTE,
+    most voted first. A single neighbour suggests all of its tags.
+    """
+    votes: Dict[int, float] = {}
+    tags: Dict[int, response_schemas.Tag] = {}
+    total = 0.0
+    for image_id, distance in neighbours:
+        weight = max(1 - float(distance), 0.0)
+        total += weight
+        for tag in tags_of.get(int(image_id), []):
+            votes[tag.id] = votes.get(tag.id, 0.0) + weight
+            tags[tag.id] = tag
+    suggested = [
+        tags[tag_id] for tag_id, vote in sorted(votes.items(), key=lambda item: -item[1])
+        if total > 0 and vote / total >= settings.SUGGEST_MIN_VOTE
+    ]
+    return response_schemas.TagList(count=len(suggested), tags=suggested)
+
+
+def save_upload(session: Session, click_client: Any, image_create: request_schemas.ImageCreate,
+                embed: List[float], duplicate: Optional[response_schemas.Image] = None) -> response_schemas.UploadResponse:
+    """save image to db and clickhouse, suggest tags of the most similar stored images
+
+    One top-k search gives both the near duplicate and the neighbours, one
+    postgres query their thumbnails and tags. A near duplicate suggests its own
+    tags, otherwise the neighbours vote. When `duplicate` (stored image with
+    identical content) is given, it is the near duplicate and no search runs.
+    """
+    image = crud.create_image(session, image_create)
+    tag_index = get_tag_index()
+    if tag_index is not None:
+        tag_index.mark_unknown([tag.id for tag in image.tags])
+    if duplicate is not None:
+        duplicates, nearest = [(duplicate.id, 0.0)], []
+    else:
+        duplicates, nearest = neighbourhood(click_client, embed)
+    # save to clickhouse
+    add_image(click_client, image.id, embed, [0], [tag.id for tag in image.tags])
+    log.debug(f"Similar image found: {duplicates}")
+    found = crud.get_neighbourhood(session, [int(row[0]) for row in duplicates[:1] + nearest])
+    tags_of = {image_id: tags for image_id, (_, tags) in found.items()}
+    similar_image_pth = "no"
+    if duplicates and int(duplicates[0][0]) in found:
+        log.info(f"Similar image found: {duplicates}")
+        similar_image_pth, _ = found[int(duplicates[0][0])]
+        tags_similar = suggest_tags(duplicates[:1], tags_of)
+    else:
+        tags_similar = suggest_tags(nearest, tags_of)
+    return response_schemas.UploadResponse(
+        status="success",
+        message="file uploaded",
+        image_id=image.id,
+        full_path=image_create.original_file_path,
+        thumbnail_path=image_create.thumbnail_file_path,
+        embed=embed,
+        similar_image_pth=similar_image_pth,
+        suggested_tags=tags_similar,
+        predicted_tags=tag_index.predict(embed) if tag_index is not None else None,
+    )
+
+
+def prepare_file(client: Minio, index: int, source: IngestFile) -> PreparedFile:
+    """blocking storage stages of one file: original, thumbnails, exif"""
+    if source.content_type not in settings.ALLOWED_FILE_TYPES:
+        raise IngestError("File type not allowed")
+    object_name, full_path, content_hash = store_original(client, source.file, source.size, source.filename)
+    thumbnail, model_ready = render_thumbnails(object_name, source.file, source.size)
+    thumbnail_path = store_thumbnail(client, object_name, thumbnail)
+    return PreparedFile(
+        index=index,
+        source=source,
+        full_path=full_path,
+        thumbnail_path=thumbnail_path,
+        model_ready=model_ready,
+        exif=read_exif(source.file),
+        content_hash=content_hash,
+        phash=imaging.dhash(model_ready),
+    )
+
+
+def failed(source: IngestFile, message: str) -> response_schemas.BatchUploadItem:
+    return response_schemas.BatchUploadItem(filename=source.filename, status="failed", message=message)
+
+
+async def persist_batch(batch: List[PreparedFile], session: Session, click_client: Any,
+                        nuclio: NuclioClient, results: List[Optional[response_schemas.BatchUploadItem]]) -> None:
+    """one embedding call, one postgres transaction and one clickhouse insert for the whole batch
+
+    Files whose content is already stored (same sha256, also within the batch)
+    reuse that embedding and are not sent to the model. The postgres rows are
+    committed only after the clickhouse insert succeeded, so a failed insert
+    leaves no images without vectors.
+    """
+    inserted: List[int] = []
+    try:
+        duplicates = await asyncio.to_thread(
+            crud.get_images_by_hashes, session, list({item.content_hash for item in batch}))
+        known = {}
+        for content_hash, duplicate in list(duplicates.items()):
+            try:
+                known[content_hash] = list(await asyncio.to_thread(get_image_vector, click_client, duplicate.id))
+            except IndexError:
+                del duplicates[content_hash]
+        unknown = list({item.content_hash: item for item in batch if item.content_hash not in known}.values())
+        if unknown:
+            embeds = await nuclio.embed_images([b64encode(item.model_ready).decode() for item in unknown])
+            known.update(zip([item.content_hash for item in unknown], embeds))
+        embeds = [known[item.content_hash] for item in batch]
+        images = await asyncio.to_thread(crud.create_images, session, [
+            request_schemas.ImageCreate(
+                original_file_path=item.full_path,
+                thumbnail_file_path=item.thumbnail_path,
+                description=item.source.description,
+                exif=item.exif,
+                metainfo=item.source.metainfo,
+                tags=item.source.tags,
+                content_hash=item.content_hash,
+                phash=item.phash,
+            )
+            for item in batch
+        ])
+        await asyncio.to_thread(add_images, click_client, [image.id for image in images], embeds,
+                                None, [[tag.id for tag in image.tags] for image in images])
+        inserted = [image.id for image in images]
+        await asyncio.to_thread(session.commit)
+        tag_index = get_tag_index()
+        if tag_index is not None:
+            tag_index.mark_unknown([tag.id for image in images for tag in image.tags])
+    except Exception as ex:
+        log.error(f"failed to persist batch of {len(batch)} files {ex!r}")
+        await asyncio.to_thread(session.rollback)
+        for image_id in inserted:
+            try:
+                await asyncio.to_thread(delete_image, click_client, image_id)
+            except Exception as ex:
+                log.error(f"failed to delete vector of uncommitted image {image_id} {ex!r}")
+        for item in batch:
+            results[item.index] = failed(item.source, "Failed to save image")
+        return
+    # the first copy of new content in the batch is the original of the later ones
+    originals = {item.content_hash: image.id for item, image in reversed(list(zip(batch, images)))}
+    for item, image, embed in zip(batch, images, embeds):
+        if item.content_hash in duplicates:
+            duplicate_of = duplicates[item.content_hash].id
+        else:
+            duplicate_of = originals[item.content_hash] if originals[item.content_hash] != image.id else None
+        results[item.index] = response_schemas.BatchUploadItem(
+            filename=item.source.filename,
+            status="success",
+            message="file uploaded",
+            image_id=image.id,
+            full_path=item.full_path,
+            thumbnail_path=item.thumbnail_path,
+            duplicate_of=duplicate_of,
+            predicted_tags=tag_index.predict(embed) if tag_index is not None else None,
+        )
+
+
+async def ingest_files(files: List[IngestFile], client: Minio, session: Session, click_client: Any,
+                       nuclio: NuclioClient, concurrency: int = None, batch_size: int = None) -> response_schemas.BatchUploadResponse:
+    """Upload many files through a bounded pipeline.
+
+    Up to `concurrency` files go through the storage stages (minio, imgproxy) at
+    once while finished files are embedded and written in batches of `batch_size`.
+    The queue between the two halves is bounded, so slow writes hold back storage.
+    """
+    concurrency = concurrency or settings.INGEST_CONCURRENCY
+    batch_size = batch_size or settings.INGEST_BATCH_SIZE
+    results: List[Optional[response_schemas.BatchUploadItem]] = [None] * len(files)
+    prepared: asyncio.Queue = asyncio.Queue(maxsize=batch_size * 2)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def prepare(index: int, source: IngestFile) -> None:
+        item = None
+        async with semaphore:
+            try:
+                item = await asyncio.to_thread(prepare_file, client, index, source)
+            except IngestError as ex:
+                results[index] = failed(source, str(ex))
+            except Exception as ex:
+                log.error(f"failed to prepare {source.filename} {ex!r}")
+                results[index] = failed(source, "Failed to upload file")
+        await prepared.put(item)
+
+    producers = [asyncio.create_task(prepare(index, source)) for index, source in enumerate(files)]
+    batch: List[PreparedFile] = []
+    for _ in files:
+        item = await prepared.get()
+        if item is not None:
+            batch.append(item)
+        if len(batch) >= batch_size:
+            await persist_batch(batch, session, click_client, nuclio, results)
+            batch = []
+    if batch:
+        await persist_batch(batch, session, click_client, nuclio, results)
+    await asyncio.gather(*producers)
+
+    uploaded = sum(1 for result in results if result.status == "success")
+    return response_schemas.BatchUploadResponse(
+        count=len(results),
+        uploaded=uploaded,
+        failed=len(results) - uploaded,
+        results=results,
+    )
@@ -0,0 +1,207 @@
+"""Asynchronous uploads: the original is stored right away, the rest runs in a worker pool.
+
+Jobs live in redis (`upload-job:<id>` json records, `upload-jobs` list as queue),
+so workers in the api process and standalone `python -m app.upload_worker`
+processes consume the same queue. A taken job id is moved atomically to the
+`upload-jobs:processing` list and removed from there once the job finished.
+Ids left behind by a crashed worker are queued again when they are older
+than UPLOAD_JOB_STALE_SECONDS, checked at start up and then periodically.
+Only jobs marked processing (with their start time) count as stale; one still
+marked queued was just taken, unless it stays so for UPLOAD_JOB_STALE_SECONDS.
+"""
+from app.config import log
+from app.config import settings
+from app.schemas import response_schemas, request_schemas
+from app.core import database
+from app.core.ingest import IngestError, render_thumbnails, store_thumbnail, read_exif, save_upload, known_embedding
+from app.utils.imaging import dhash
+from app.nuclio.client import NuclioClient, InferenceError
+from minio import Minio
+from base64 import b64encode
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple
+from tempfile import SpooledTemporaryFile
+from uuid import uuid4
+import asyncio
+import json
+import time
+
+QUEUE = "upload-jobs"
+PROCESSING = "upload-jobs:processing"
+
+Workers: List[asyncio.Task] = []
+# ids seen in the processing list while still marked queued -> first seen at
+Unclaimed: Dict[str, float] = {}
+
+
+def job_key(job_id: str) -> str:
+    return f"upload-job:{job_id}"
+
+
+async def save_job(redis: Any, job_id: str, job: Dict) -> None:
+    await redis.set(job_key(job_id), json.dumps(job), ex=settings.UPLOAD_JOB_TTL)
+
+
+async def get_job(redis: Any, job_id: str) -> Optional[Dict]:
+    raw = await redis.get(job_key(job_id))
+    return json.loads(raw) if raw is not None else None
+
+
+async def enqueue_upload(redis: Any, object_name: str, full_path: str, description: str,
+                         metainfo: Dict, tags: List[str], content_hash: Optional[str] = None) -> str:
+    job_id = str(uuid4())
+    await save_job(redis, job_id, {
+        "status": "queued",
+        "object_name": object_name,
+        "full_path": full_path,
+        "description": description,
+        "metainfo": metainfo,
+        "tags": tags,
+        "content_hash": content_hash,
+    })
+    await redis.lpush(QUEUE, job_id)
+    return job_id
+
+
+def known_embedding_of(click_client: Any, content_hash: str):
+    session = database.SessionLocal()
+    try:
+        return known_embedding(session, click_client, content_hash)
+    finally:
+        session.close()
+
+
+def load_original(client: Minio, object_name: str) -> Tuple[BinaryIO, int]:
+    """stream original from minio into a spooled temp file, returns (file, size)"""
+    file = SpooledTemporaryFile(max_size=settings.IMAGE_POOL_MAX_BYTES)
+    response = client.get_object(settings.DEFAULT_BUCKET, object_name)
+    try:
+        for chunk in response.stream(1024 * 1024):
+            file.write(chunk)
+    finally:
+        response.close()
+        response.release_conn()
+    return file, file.tell()
+
+
+async def process_job(job: Dict, client: Minio, click_client: Any, nuclio: NuclioClient) -> response_schemas.UploadResponse:
+    original, size = await asyncio.to_thread(load_original, client, job["object_name"])
+    with original:
+        thumbnail, model_ready = await asyncio.to_thread(render_thumbnails, job["object_name"], original, size)
+        exif = read_exif(original)
+    thumbnail_path = await asyncio.to_thread(store_thumbnail, client, job["object_name"], thumbnail)
+    content_hash = job.get("content_hash")
+    duplicate, embed = None, None
+    if content_hash is not None:
+        duplicate, embed = await asyncio.to_thread(known_embedding_of, click_client, content_hash)
+    if embed is None:
+        embed = await nuclio.embed_image(b64encode(model_ready).decode())
+    image_create = request_schemas.ImageCreate(
+        original_file_path=job["full_path"],
+        thumbnail_file_path=thumbnail_path,
+        description=job["description"],
+        exif=exif,
+        metainfo=job["metainfo"],
+        tags=job["tags"],
+        content_hash=content_hash,
+        phash=dhash(model_ready),
+    )
+
+    def save():
+        session = database.SessionLocal()
+        try:
+            return save_upload(session, click_client, image_create, embed, duplicate=duplicate)
+        finally:
+            session.close()
+
+    return await asyncio.to_thread(save)
+
+
+async def requeue(redis: Any, job_id: str) -> bool:
+    """move a job from the processing list back to the front of the queue"""
+    # only the caller that removed the id requeues it, concurrent recoveries do not duplicate it
+    if not await redis.lrem(PROCESSING, 1, job_id):
+        return False
+    await redis.rpush(QUEUE, job_id)
+    return True
+
+
+async def requeue_stale(redis: Any) -> int:
+    """queue again the jobs of crashed workers, returns how many"""
+    requeued = 0
+    now = time.time()
+    taken = [raw.decode() for raw in await redis.lrange(PROCESSING, 0, -1)]
+    for job_id in list(Unclaimed):
+        if job_id not in taken:
+            del Unclaimed[job_id]
+    for job_id in taken:
+        job = await get_job(redis, job_id)
+        if job is None or job["status"] in ("done", "failed"):
+            # finished, the worker died before removing it
+            await redis.lrem(PROCESSING, 1, job_id)
+        elif job["status"] == "processing" and "started_at" in job:
+            if now - job["started_at"] > settings.UPLOAD_JOB_STALE_SECONDS:
+                requeued += await requeue(redis, job_id)
+        # just taken, its worker is about to mark it processing, unless it died in between
+        elif now - Unclaimed.setdefault(job_id, now) > settings.UPLOAD_JOB_STALE_SECONDS:
+            Unclaimed.pop(job_id)
+            requeued += await requeue(redis, job_id)
+    if requeued:
+        log.warning(f"requeued {requeued} upload jobs of crashed workers")
+    return requeued
+
+
+async def worker(redis: Any, client: Minio, click_client: Any, nuclio: NuclioClient, recover: bool = False) -> None:
+    """`recover` makes this worker also look for stale jobs"""
+    recovered_at = 0.0
+    while True:
+        if recover and time.monotonic() - recovered_at > settings.UPLOAD_JOB_STALE_SECONDS:
+            try:
+                await requeue_stale(redis)
+            except Exception as ex:
+                log.error(f"failed to requeue stale upload jobs {ex!r}")
+            recovered_at = time.monotonic()
+        moved = await redis.blmove(QUEUE, PROCESSING, 5, src="RIGHT", dest="LEFT")
+        if moved is None:
+            continue
+        job_id = moved.decode()
+        job = await get_job(redis, job_id)
+        if job is None:
+            log.warning(f"upload job {job_id} expired before processing")
+            await redis.lrem(PROCESSING, 1, job_id)
+            continue
+        job["status"] = "processing"
+        job["started_at"] = time.time()
+        await save_job(redis, job_id, job)
+        try:
+            result = await process_job(job, client, click_client, nuclio)
+            job["status"] = "done"
+            job["result"] = result.model_dump()
+        except asyncio.CancelledError:
+            # shutting down, another worker takes the job over
+            job["status"] = "queued"
+            await save_job(redis, job_id, job)
+            await requeue(redis, job_id)
+            raise
+        except (IngestError, InferenceError) as ex:
+            job["status"] = "failed"
+            job["message"] = str(ex)
+        except Exception as ex:
+            log.exception(f"upload job {job_id} failed {ex!r}")
+            job["status"] = "failed"
+            job["message"] = "Failed to upload file"
+        await save_job(redis, job_id, job)
+        await redis.lrem(PROCESSING, 1, job_id)
+
+
+def start_upload_workers(redis: Any, client: Minio, click_client: Any, nuclio: NuclioClient, count: int = None):
+    count = settings.UPLOAD_WORKERS if count is None else count
+    for i in range(count):
+        Workers.append(asyncio.create_task(worker(redis, client, click_client, nuclio, recover=i == 0)))
+    log.info(f"started {count} upload workers")
+
+
+async def stop_upload_workers():
+    for task in Workers:
+        task.cancel()
+    await asyncio.gather(*Workers, return_exceptions=True)
+    Workers.clear()
@@ -1,12 +1,12 @@
 from fastapi import APIRouter, Depends, HTTPException, status, File
 from sqlalchemy import CursorResult
 
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi.responses import FileResponse
 from app.config import log
 from app.schemas import response_schemas, request_schemas
-from app.core.dependencies import get_db
-from app.core import crud
+from app.core.dependencies import get_async_db
+from app.core import async_crud
 from app.config import settings
 from app.utils.token import get_current_active_user, get_current_active_admin
 
@@ -23,13 +23,13 @@ router = APIRouter(
 @router.post("/store/add", response_model=response_schemas.UserStore)
 async def add_user_store(
     user_store: request_schemas.UserStoreCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: response_schemas.User = Depends(get_current_active_user),
 ):
     """
     Add user store
     """
-    user_store = crud.create_user_store(db=db, user=current_user, store_name=user_store.store_name)
+    user_store = await async_crud.create_user_store(db=db, user=current_user, store_name=user_store.store_name)
 
     return user_store
 
@@ -38,13 +38,13 @@ async def add_user_store(
 async def edit_user_store(
     id: int,
     user_store: request_schemas.UserStoreEdit,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: response_schemas.User = Depends(get_current_active_user)
 ):
     """
     Edit user store
     """
-    user_store = crud.update_user_store(db=db, user=current_user, store_id=id, store_name=user_store.store_name)
+    user_store = await async_crud.update_user_store(db=db, user=current_user, store_id=id, store_name=user_store.store_name)
 
     return user_store
 
@@ -52,13 +52,13 @@ async def edit_user_store(
 # get usere stores
 @router.get("/store/all", response_model=response_schemas.UserStoreList)
 async def get_user_stores(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: response_schemas.User = Depends(get_current_active_user),
 ):
     """
     Get user stores
     """
-    user_stores = crud.get_all_user_stores(db=db, user=current_user)
+    user_stores = await async_crud.get_all_user_stores(db=db, user=current_user)
     if user_stores is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -71,13 +71,13 @@ async def get_user_stores(
 @router.get("/store/{id}", response_model=response_schemas.ImageList)
 async def get_user_store_images(
     id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: response_schemas.User = Depends(get_current_active_user),
 ):
     """
     Get user store images
     """
-    images = crud.get_all_images_from_user_store(db=db, user=current_user, store_id=id)
+    images = await async_crud.get_all_images_from_user_store(db=db, user=current_user, store_id=id)
 
     return images
 
@@ -86,12 +86,12 @@ async def get_user_store_images(
 async def add_image_to_user_store(
     id: int,
     image_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: response_schemas.User = Depends(get_current_active_user),
 ):
     """
     Add image to user store
     """
-    user_store = crud.add_image_to_user_store(db=db, user=current_user, store_id=id, image_id=image_id)
+    user_store = await async_crud.add_image_to_user_store(db=db, user=current_user, store_id=id, image_id=image_id)
 
     return user_store
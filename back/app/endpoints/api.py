@@ -5,6 +5,7 @@ from app.endpoints.search import router as search_router
 # from app.endpoints.admin import router as admin_router
 from app.endpoints.account import router as account_router
 from app.endpoints.uploader import router as uploader_router
+from app.endpoints.metrics import router as metrics_router
 
 
 router = APIRouter(
@@ -15,5 +16,5 @@ router = APIRouter(
 router.include_router(auth_router)
 router.include_router(search_router)
 router.include_router(account_router)
-# router.include_router(metrics_router)
+router.include_router(metrics_router)
 router.include_router(uploader_router)
@@ -1,15 +1,16 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
 
-from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from typing import Annotated
 from datetime import timedelta
 
 from app.config import log
 from app.schemas import response_schemas, request_schemas
-from app.core.dependencies import get_db
-from app.core import crud
+from app.core.dependencies import get_async_db
+from app.core import async_crud
 from app.config import settings
 from app.utils.token import get_current_active_user
 from app.utils.token import (
@@ -17,22 +18,29 @@ from app.utils.token import (
     create_access_token,
 )
 from app.utils.email import verify_email
+from app.utils.passwords import PasswordHashBusy
 
 router = APIRouter(
     prefix="/user",
     tags=["user"],
 )
 
+password_busy_exception = HTTPException(
+    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+    detail="Too many password checks in progress, retry shortly",
+    headers={"Retry-After": "1"},
+)
+
 
 @router.post("/create", response_model=response_schemas.Token)
 async def create_user(
     user: request_schemas.UserCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """
     Create a new user
     """
-    db_user = crud.get_user(db, user.email)
+    db_user = await async_crud.get_user(db, user.email)
 
     if db_user:
         raise HTTPException(
@@ -48,7 +56,16 @@ async def create_user(
     #         detail="Email is not valid",
     #     )
 
-    user = crud.create_user(db=db, user=user)
+    try:
+        user = await async_crud.create_user(db=db, user=user)
+    except IntegrityError:
+        # registered concurrently, caught by the unique email index
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Email already registered",
+        )
+    except PasswordHashBusy:
+        raise password_busy_exception
     access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
         data={"email": user.email}, expires_delta=access_token_expires
@@ -59,12 +76,15 @@ async def create_user(
 @router.post("/token", response_model=response_schemas.Token)
 async def login_for_access_token(
     form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """
     we use username in OAuth2PasswordRequestForm as email
     """
-    user = authenticate_user(db, form_data.username, form_data.password)
+    try:
+        user = await authenticate_user(db, form_data.username, form_data.password)
+    except PasswordHashBusy:
+        raise password_busy_exception
     if not user:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -87,9 +107,17 @@ async def get_user_profile(
 async def update_user(
     user: request_schemas.UserUpdate,
     current_user: response_schemas.User = Depends(get_current_active_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """
     Update user profile
     """
-    return crud.user_update(db=db, user=user, current_user=current_user)
\ No newline at end of file
+    try:
+        return await async_crud.user_update(db=db, user=user, current_user=current_user)
+    except IntegrityError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Email already registered",
+        )
+    except PasswordHashBusy:
+        raise password_busy_exception
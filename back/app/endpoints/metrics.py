@@ -0,0 +1,44 @@
+from fastapi import APIRouter, Depends
+
+from app.schemas import response_schemas
+from app.cache.dependencies import get_embed_cache
+from app.nuclio.dependencies import get_nuclio
+from app.utils.passwords import get_password_hasher
+from app.utils.token import get_current_active_user
+
+router = APIRouter(
+    prefix="/metrics",
+    tags=["metrics"],
+)
+
+@router.get("/embedding-cache", response_model=response_schemas.EmbeddingCacheStats)
+async def get_embedding_cache_stats(
+    embed_cache = Depends(get_embed_cache),
+    current_user: response_schemas.User = Depends(get_current_active_user),
+):
+    """
+    Hit/miss counters of the text query embedding cache
+    """
+    return embed_cache.stats()
+
+@router.get("/inference-batcher", response_model=response_schemas.InferenceBatcherStats)
+async def get_inference_batcher_stats(
+    nuclio = Depends(get_nuclio),
+    current_user: response_schemas.User = Depends(get_current_active_user),
+):
+    """
+    Batch size distribution and queue wait of the inference micro-batcher
+    """
+    if nuclio.batcher is None:
+        return {"enabled": False}
+    return {"enabled": True, **nuclio.batcher.stats()}
+
+@router.get("/password-hashing", response_model=response_schemas.PasswordHashStats)
+async def get_password_hashing_stats(
+    hasher = Depends(get_password_hasher),
+    current_user: response_schemas.User = Depends(get_current_active_user),
+):
+    """
+    Queue depth, queue wait and hash time of the password hashing pool
+    """
+    return hasher.stats()
@@ -1,20 +1,26 @@
 from fastapi import APIRouter, Depends, HTTPException, File, UploadFile, status, Query
 
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.config import log
 from app.schemas import response_schemas
-from app.core.dependencies import get_db
+from app.core.dependencies import get_async_db
 from app.click.dependencies import get_click
+from app.cache.dependencies import get_embed_cache
+from app.nuclio.dependencies import get_nuclio
+from app.nuclio.client import InferenceError
 from app.click.vector_utils import cosine_compare, get_image_vector
-from app.core import crud
+from app.click import neighbours
+from app.click.rerank import rerank
+from app.core import async_crud
 from app.config import settings
 from app.utils.token import get_current_active_user, get_current_active_admin
+from app.utils.imaging import render_model_input
+from app.core.ingest import file_sha256, stored_embedding
+from fastapi.concurrency import run_in_threadpool
 from base64 import b64encode
 from fastapi_cache.decorator import cache
 from typing import List
-import numpy as np
-import requests
 import time
 
 router = APIRouter(
@@ -22,37 +28,16 @@ router = APIRouter(
     tags=["search"],
 )
 
-def get_propper_probalities(data):
-
-    response = []
-    probs = np.array([1-elem[1] for elem in data])
-    #first range
-    i = 0
-    top_one = probs[(probs >= 0.9) & (probs < 0.98)]
-    if top_one.shape[0] != 0:
-        response.append(data[i + top_one.argmax()])
-    i += top_one.shape[0]
-    r = min(0.9, 1 - data[0][1])
-    step = 0.01
-    while len(response) < 5 and r - step > 0.65:
-        top_one = probs[(probs >= r - step) & (probs < r)]
-        if top_one.shape[0] != 0:
-            response.append(data[i + top_one.argmax()])
-            r = top_one.max() - 0.015
-        else:
-            r -= step
-        i += top_one.shape[0]
-    return response
 # get all tags
 @router.get("/tags", response_model=response_schemas.TagList)
 @cache(expire=settings.CACHE_EXPIRE)
 async def get_tags(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """
     Get all tags
     """
-    tags = crud.get_all_tags(db=db)
+    tags = await async_crud.get_all_tags(db=db)
 
     if tags is None:
         raise HTTPException(
@@ -66,129 +51,149 @@ async def get_tags(
 @router.get("/images", response_model=response_schemas.ImageListResponse)
 @cache(expire=settings.CACHE_EXPIRE)
 async def get_images(
-    db: Session = Depends(get_db),
+    cursor: str = Query(None),
+    per_page: int = Query(None, ge=1),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """
-    Get all images with pagination
-    """
-    images = crud.get_all_images(db=db)
+    Get all images with pagination, newest first
 
-    if images is None:
+    pass `next_cursor` of a page as `cursor` to get the next one
+    """
+    try:
+        return await async_crud.get_all_images(db=db, on_page=per_page, cursor=cursor)
+    except ValueError:
         raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="No images found",
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor",
         )
 
-    return images
-
 # get all images by tags and/or search string
-@router.get("/images/search", response_model=response_schemas.ImageList)
+@router.get("/images/search", response_model=response_schemas.TaggedImageList)
 # @cache(expire=settings.CACHE_EXPIRE)
 async def search_images(
     tags: List[str] = Query(None),
+    match: str = Query("any", pattern="^(any|all)$"),
     search: str = Query(None),
-    db: Session = Depends(get_db),
-    page: int = Query(None),
-    per_page: int = Query(None),
+    camera: str = Query(None),
+    region: str = Query(None),
+    author: str = Query(None),
+    license: str = Query(None),
+    db: AsyncSession = Depends(get_async_db),
+    cursor: str = Query(None),
+    per_page: int = Query(None, ge=1),
     click = Depends(get_click),
+    embed_cache = Depends(get_embed_cache),
+    nuclio = Depends(get_nuclio),
 ):
     """
-    Get all images by tags and/or search string
+    Get all images by tags, exif / metainfo fields and/or search string
+
+    match=any returns images with at least one of `tags`, match=all images with every tag.
+    camera (exif Model), region, author and license (metainfo) must match exactly.
+    Listing and filtered results are paged: pass `next_cursor` of a page as `cursor`.
     """
     if search != None:
         if len(search) < 3: search = None
     if tags != None:
         if len(tags) < 1: tags = None
+    metadata = {"camera": camera, "region": region, "author": author, "license": license}
+    has_metadata = any(value is not None for value in metadata.values())
+    filtered = tags is not None or has_metadata
 
-    if search is None and tags is None:
-        if page and per_page:
-            images = crud.get_all_images(db=db, on_page=per_page, page_num=page)
-            return images
-        else:
+    if search is None and not filtered:
+        try:
+            return await async_crud.get_all_images(db=db, on_page=per_page, cursor=cursor)
+        except ValueError:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
-                detail="No tags and search string",
+                detail="Invalid cursor",
             )
     if search:
         log.debug(f"searching images by {search}")
         # search images via clickhouse
-        # first, get text embedding via nuclio
-        response = requests.post(
-            settings.NUCLIO_API_URL,
-            json={"mode": "text", "texts": [search]},
-            headers={"Content-Type": "application/json",
-                     "x-nuclio-function-name": "clip-function",
-                     "x-nuclio-function-namespace": "nuclio"}
-        )
-        if response.status_code != 200:
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Failed to get model_ready image",
-            )
-        embed = response.json()["embed"][0]
-        # search images via clickhouse
-        click_respone = cosine_compare(click, embed)
+        # first, get text embedding from cache or via nuclio
+        embed = await embed_cache.get_text(search)
+        if embed is None:
+            try:
+                embed = await nuclio.embed_text(search)
+            except InferenceError:
+                raise HTTPException(
+                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    detail="Failed to get model_ready image",
+                )
+            await embed_cache.set_text(search, embed)
+        tag_ids = None
+        if tags:
+            known_tags = await async_crud.get_tag_ids(db=db, tag_names=tags)
+            tag_ids = list(known_tags.values())
+            if not tag_ids or (match == "all" and len(known_tags) < len(set(tags))):
+                return response_schemas.TaggedImageList(count=0, images=[])
+        # search images via clickhouse, the tag filter is applied inside the top-k
+        click_respone = cosine_compare(click, embed, tag_ids=tag_ids, match=match)
         log.debug(f"search response {click_respone}")
         image_ids_search = [int(row[0]) for row in click_respone]
-        images_search: response_schemas.ImageList = crud.get_images_by_ids(db=db, image_ids=image_ids_search)
-    if tags:
-        images_tags: response_schemas.ImageList = crud.get_images_with_tags(db=db, tags=tags)
-    if search and tags:
-        # merge two classes, preserve ids from tags
-        images_list = []
-        for image in images_tags.images:
-            if image.id in image_ids_search:
-                images_list.append(image)
-        images = response_schemas.ImageList(
-            count=len(images_list),
-            images=images_list,
-        )
-        return images
-    if search:
-        return images_search
-    if tags:
-        return images_tags
-
-    if images is None:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="No images found",
-        )
+        if not has_metadata:
+            return await async_crud.get_tagged_images_by_ids(db=db, image_ids=image_ids_search)
+    if filtered:
+        # with a search string only its hits are filtered by exif / metainfo, in the database
+        try:
+            return await async_crud.find_images(
+                db=db,
+                tags=None if search else tags,
+                match=match,
+                metadata=metadata,
+                on_page=per_page,
+                cursor=cursor,
+                image_ids=image_ids_search if search else None,
+            )
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid cursor",
+            )
 
 # find similar image by uploaded image
 @router.post("/images/similar", response_model=response_schemas.ImageList)
 # @cache(expire=settings.CACHE_EXPIRE)
 async def find_similar_image(
     file: UploadFile = File(...),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     click = Depends(get_click),
+    nuclio = Depends(get_nuclio),
+    embed_cache = Depends(get_embed_cache),
 ):
     """
     Find similar image by uploaded image
     """
     try:
-        encoded_image = b64encode(file.file.read()).decode()
-        # get image embedding via nuclio
-        response = requests.post(
-            settings.NUCLIO_API_URL,
-            json={"mode": "image", "image": encoded_image},
-            headers={"Content-Type": "application/json",
-                     "x-nuclio-function-name": "clip-function",
-                     "x-nuclio-function-namespace": "nuclio"}
-        )
-        if response.status_code != 200:
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Failed to get model_ready image",
-            )
-        embed = response.json()["embed"][0]
+        # known content (repeated reference image or stored photo) skips inference
+        content_hash = await run_in_threadpool(file_sha256, file.file)
+        embed = await embed_cache.get_image(content_hash)
+        if embed is None:
+            duplicate = await async_crud.get_image_by_hash(db, content_hash)
+            if duplicate is not None:
+                embed = await run_in_threadpool(stored_embedding, click, duplicate)
+        if embed is None:
+            # only the 288px model input is base64 encoded, the upload is decoded straight from its stream
+            model_ready = await run_in_threadpool(render_model_input, file.file)
+            encoded_image = b64encode(model_ready).decode()
+            # get image embedding via nuclio
+            try:
+                embed = await nuclio.embed_image(encoded_image)
+            except InferenceError:
+                raise HTTPException(
+                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    detail="Failed to get model_ready image",
+                )
+        await embed_cache.set_image(content_hash, embed)
         # find similar images via clickhouse
-        click_respone = cosine_compare(click, embed, limit=False)
+        click_respone = cosine_compare(click, embed, k=settings.RERANK_CANDIDATES)
         log.debug(f"click embeed output: {click_respone}")
-        # get top 5 images
-        click_respone = get_propper_probalities(click_respone)
+        # diverse top images out of the candidates
+        click_respone = rerank(click, click_respone)
         image_ids = [int(row[0]) for row in click_respone]
-        images: response_schemas.ImageList = crud.get_images_by_ids(db=db, image_ids=image_ids)
+        images: response_schemas.ImageList = await async_crud.get_images_by_ids(db=db, image_ids=image_ids)
         return images
     except Exception as ex:
         log.error(f"failed to find similar image {ex.with_traceback()}")
@@ -202,12 +207,12 @@ async def find_similar_image(
 # @cache(expire=settings.CACHE_EXPIRE)
 async def get_image_by_id(
     image: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """
     Get image by id
     """
-    image = crud.get_image_by_id(db=db, image_id=image)
+    image = await async_crud.get_image_by_id(db=db, image_id=image)
 
     if image is None:
         raise HTTPException(
@@ -222,20 +227,30 @@ async def get_image_by_id(
 # @cache(expire=settings.CACHE_EXPIRE)
 async def get_similar_images(
     image_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     click = Depends(get_click),
 ):
     """
     Get similar images to given image id
     """
-    # get image vector from clickhouse
-    image_vector = get_image_vector(client=click, image_id=image_id)
-    # find similar images via clickhouse
-    click_respone = cosine_compare(click, image_vector, limit=False)
+    if settings.NEIGHBOURS_K > 0:
+        # precomputed neighbours, computed and stored on the first request for images without them
+        click_respone = neighbours.get_neighbours(click, image_id)
+        if click_respone is None:
+            image_vector = get_image_vector(client=click, image_id=image_id)
+            click_respone = neighbours.nearest(click, image_vector, exclude=[image_id])
+            neighbours.store(click, {image_id: click_respone})
+    else:
+        # get image vector from clickhouse
+        image_vector = get_image_vector(client=click, image_id=image_id)
+        # find similar images via clickhouse
+        click_respone = cosine_compare(click, image_vector, k=settings.RERANK_CANDIDATES)
     log.debug(f"click embeed output: {click_respone}")
-    # get top 5 images
-    click_respone = get_propper_probalities(click_respone)
+    if not click_respone:
+        return response_schemas.ImageList(count=0, images=[])
+    # diverse top images out of the candidates
+    click_respone = rerank(click, click_respone)
     log.debug(f"click embeed output after filter: {click_respone}")
     image_ids = [int(row[0]) for row in click_respone]
-    images: response_schemas.ImageList = crud.get_images_by_ids(db=db, image_ids=image_ids)
+    images: response_schemas.ImageList = await async_crud.get_images_by_ids(db=db, image_ids=image_ids)
     return images
\ No newline at end of file
@@ -1,4 +1,6 @@
 from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks, File, UploadFile, Form
+from fastapi.concurrency import run_in_threadpool
+from typing import List
 
 from sqlalchemy.orm import Session
 
@@ -7,28 +9,26 @@ from app.schemas import response_schemas, request_schemas
 from app.core.dependencies import get_db
 from app.s3.storage import get_client
 from app.click.dependencies import get_click
-from app.click.vector_utils import check_if_similar, add_image, cosine_compare
+from app.click.vector_utils import delete_image as delete_image_vector
+from app.nuclio.dependencies import get_nuclio
+from app.cache.redis import get_redis
+from app.core.jobs import enqueue_upload, get_job
+from app.core.ingest import IngestFile, ingest_files, store_original, render_thumbnails, store_thumbnail, read_exif, save_upload, known_embedding
+from app.utils import imaging
 from minio import Minio
-from uuid import uuid4
-from base64 import urlsafe_b64encode, b64encode
+from base64 import b64encode
 from app.core import crud
 from app.config import settings
 import requests
 import asyncio
 import os
 import json
-from io import BytesIO
-from PIL import Image
-from PIL import ExifTags
 
 router = APIRouter(
     prefix="/uploader",
     tags=["uploader"],
 )
 
-def base64UrlEncode(data):
-    return urlsafe_b64encode(data).rstrip(b'=')
-
 @router.post("/upload", response_model=response_schemas.UploadResponse)
 def upload_file(
     background_tasks: BackgroundTasks,
@@ -61,105 +61,45 @@ def upload_file(
         )
     try:
         # save file to minio with uuid as object name
-        object_name = f"{uuid4()}.{file.filename.split('.')[-1]}"
-        client.put_object(settings.DEFAULT_BUCKET, object_name, file.file, file.size)
-        full_path = f"{settings.S3_ENDPOINT}/{settings.DEFAULT_BUCKET}/{object_name}"
-        s3_url = f"s3://{settings.DEFAULT_BUCKET}/{object_name}"
-        imgproxy_objeect_name_base = base64UrlEncode(s3_url.encode('utf-8')).decode('utf-8')
-
-        # create thumbnail via imgproxy
+        object_name, full_path, content_hash = store_original(client, file.file, file.size, file.filename)
+        # create thumbnail and model ready image
         # save aspect ratio, do not crop, try to resize to 700x700 pixels, saving in png format
-        thumbnail_path_imgproxy = f"{settings.IMGPROXY_HOST}/unsafe/rs:fit:700:700/{imgproxy_objeect_name_base}.png"
-        model_ready_imgproxy = f"{settings.IMGPROXY_HOST}/unsafe/rs:force:288:288/{imgproxy_objeect_name_base}.png"
-        # get thumbnail image with get request
-        response = requests.get(thumbnail_path_imgproxy)
-        if response.status_code != 200:
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Failed to get thumbnail",
-            )
-        response_bytes = response.content
-        raw_thumbnail = BytesIO(response_bytes)
-        raw_thumbnail_len = raw_thumbnail.getbuffer().nbytes
+        thumbnail, model_ready = render_thumbnails(object_name, file.file, file.size)
         #save to minio
-        thumbnail_object_name = f"t{object_name.split('.')[0]}-thumb.png"
-        thumbnail_path = f"{settings.S3_ENDPOINT}/{settings.DEFAULT_BUCKET}/{thumbnail_object_name}"
-        client.put_object(settings.DEFAULT_BUCKET, thumbnail_object_name, raw_thumbnail, raw_thumbnail_len)
+        thumbnail_path = store_thumbnail(client, object_name, thumbnail)
 
-        response = requests.get(model_ready_imgproxy)
-        if response.status_code != 200:
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Failed to get model_ready image",
+        # identical content already stored: reuse its embedding, skip inference
+        duplicate, embed = known_embedding(session, click_clinet, content_hash)
+        if embed is None:
+            encoded_image_ready = b64encode(model_ready).decode()
+            response = requests.post(
+                settings.NUCLIO_API_URL,
+                json={"mode": "image", "image": encoded_image_ready},
+                headers={"Content-Type": "application/json",
+                         "x-nuclio-function-name": "clip-function",
+                         "x-nuclio-function-namespace": "nuclio"}
             )
-        encoded_image_ready = b64encode(response.content).decode()
-        response = requests.post(
-            settings.NUCLIO_API_URL,
-            json={"mode": "image", "image": encoded_image_ready},
-            headers={"Content-Type": "application/json",
-                     "x-nuclio-function-name": "clip-function",
-                     "x-nuclio-function-namespace": "nuclio"}
-        )
-        if response.status_code != 200:
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Failed to get model_ready image",
-            )
-        embed = response.json()["embed"][0]
+            if response.status_code != 200:
+                raise HTTPException(
+                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    detail="Failed to get model_ready image",
+                )
+            embed = response.json()["embed"][0]
 
         # save to db and click
         # extract exif from image
-        img = Image.open(file.file)
-        exif = { ExifTags.TAGS[k]: v for k, v in img._getexif().items() if k in ExifTags.TAGS }
-        # save to db
-        image = crud.create_image(session, request_schemas.ImageCreate(
+        exif = read_exif(file.file)
+        # save to db and clickhouse, suggest tags of similar image
+        return save_upload(session, click_clinet, request_schemas.ImageCreate(
             original_file_path=full_path,
             thumbnail_file_path=thumbnail_path,
             description=description,
             exif=exif,
             metainfo=json.loads(metainfo),
-            tags=tags[0].split(',')
-        ))
-        # check if similar image exists
-        res = check_if_similar(click_clinet, embed)
-        # find most similar image
-        most_sim = cosine_compare(click_clinet, embed)
-        # save to clickhouse
-        add_image(click_clinet, image.id, embed, [0])
-        log.debug(f"Similar image found: {res}")
-        if res:
-            log.info(f"Similar image found: {res}")
-            # get path to similar image
-            image_similar = crud.get_image_by_id(session, int(res[0][0]))
-            # get tags of similar image
-            tags_similar = crud.get_tags_of_image(session, image_similar.id)
-            return response_schemas.UploadResponse(
-                status="success",
-                message="file uploaded",
-                image_id=image.id,
-                full_path=full_path,
-                thumbnail_path=thumbnail_path,
-                embed=embed,
-                similar_image_pth=image_similar.thumbnail_file_path,
-                suggested_tags=tags_similar
-            )
-        else:
-            if len(most_sim) > 0:
-                image_similar = crud.get_image_by_id(session, int(most_sim[0][0]))
-                # get tags of similar image
-                tags_similar = crud.get_tags_of_image(session, image_similar.id)
-            else:
-                tags_similar = response_schemas.TagList(count=0, tags=[])
-            # return response
-            return response_schemas.UploadResponse(
-                status="success",
-                message="file uploaded",
-                full_path=full_path,
-                thumbnail_path=thumbnail_path,
-                embed=embed,
-                similar_image_pth="no",
-                suggested_tags=tags_similar
-            )
+            tags=tags[0].split(','),
+            content_hash=content_hash,
+            phash=imaging.dhash(model_ready),
+        ), embed, duplicate=duplicate)
     except Exception as ex:
         log.error(f"failed to upload file {ex.with_traceback()}")
         raise HTTPException(
@@ -167,6 +107,88 @@ def upload_file(
             detail="Failed to upload file",
         )
 
+@router.post("/upload/async", response_model=response_schemas.UploadJob)
+async def upload_file_async(
+    description: str = Form(...),
+    metainfo: str = Form(...),
+    tags: list[str] = Form(...),
+    file: UploadFile = File(...),
+    client: Minio = Depends(get_client),
+    redis = Depends(get_redis),
+    ):
+    """Store original in S3 and queue the rest of the upload
+
+    Thumbnails, embedding, db/clickhouse writes and tag suggestion run in the
+    upload worker pool, poll /uploader/jobs/{job_id} for the UploadResponse.
+    """
+    if file.content_type not in settings.ALLOWED_FILE_TYPES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="File type not allowed",
+        )
+    try:
+        object_name, full_path, content_hash = await run_in_threadpool(store_original, client, file.file, file.size, file.filename)
+        job_id = await enqueue_upload(redis, object_name, full_path, description, json.loads(metainfo), tags[0].split(','),
+                                     content_hash=content_hash)
+    except Exception as ex:
+        log.error(f"failed to queue upload {ex!r}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to upload file",
+        )
+    return response_schemas.UploadJob(job_id=job_id, status="queued")
+
+@router.get("/jobs/{job_id}", response_model=response_schemas.UploadJobStatus)
+async def get_upload_job(
+    job_id: str,
+    redis = Depends(get_redis),
+    ):
+    """Status of asynchronous upload: queued, processing, done (result is set) or failed"""
+    job = await get_job(redis, job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Job not found",
+        )
+    return response_schemas.UploadJobStatus(
+        job_id=job_id,
+        status=job["status"],
+        message=job.get("message"),
+        result=job.get("result"),
+    )
+
+@router.post("/upload/batch", response_model=response_schemas.BatchUploadResponse)
+async def upload_files(
+    files: List[UploadFile] = File(...),
+    description: str = Form(""),
+    metainfo: str = Form("{}"),
+    tags: list[str] = Form([]),
+    client: Minio = Depends(get_client),
+    session: Session = Depends(get_db),
+    click_clinet = Depends(get_click),
+    nuclio = Depends(get_nuclio),
+    ):
+    """Upload many files at once, description, metainfo and tags apply to every file
+
+    Storage, thumbnail, embedding and db stages of different files overlap,
+    embeddings and db/clickhouse writes are batched. Returns result per file
+    in the order of `files`.
+    """
+    tags = [tag for value in tags for tag in value.split(',') if tag]
+    sources = [
+        IngestFile(
+            filename=file.filename,
+            content_type=file.content_type,
+            file=file.file,
+            size=file.size,
+            description=description,
+            metainfo=json.loads(metainfo),
+            tags=tags,
+        )
+        for file in files
+    ]
+    return await ingest_files(sources, client, session, click_clinet, nuclio)
+
 # Delete image
 @router.delete("/delete/{image_id}", response_model=response_schemas.ProcessingInfo)
 def delete_image(
@@ -196,7 +218,7 @@ def delete_image(
                 detail="Image not found",
             )
         # delete image from clickhouse
-        click_clinet.command(f"ALTER TABLE images DELETE WHERE id = {image_id}")
+        delete_image_vector(click_clinet, image_id)
         # delete image from db
         crud.delete_image(session, image_id)
         # delete image from s3
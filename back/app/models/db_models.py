@@ -9,8 +9,10 @@ from sqlalchemy import (
     TEXT,
     Numeric,
     Boolean,
-    PickleType
+    BigInteger,
+    Index,
 )
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
 from sqlalchemy.orm import relationship
@@ -23,14 +25,14 @@ class User(Base):
     __tablename__ = "user"
     id = Column(Integer, primary_key=True)
     username = Column(String(50), nullable=False)
-    email = Column(String(50), nullable=False)
+    email = Column(String(50), nullable=False, unique=True, index=True)
     hashed_password = Column(String(100), nullable=False)
     created_at = Column(DateTime, default=datetime.now())
 
 class Tag(Base):
     __tablename__ = "tag"
     id = Column(Integer, primary_key=True)
-    name = Column(String(50), nullable=False)
+    name = Column(String(50), nullable=False, unique=True, index=True)
     created_at = Column(DateTime, default=datetime.now())
 
 class Image(Base):
@@ -39,18 +41,28 @@ class Image(Base):
     original_file_path = Column(String(255), nullable=False)
     thumbnail_file_path = Column(String(255), nullable=False)
     description = Column(TEXT, nullable=True)
-    exif = Column(PickleType, nullable=False)
-    metainfo = Column(PickleType, nullable=True)
-    created_at = Column(DateTime, default=datetime.now())
+    exif = Column(JSONB, nullable=True)
+    metainfo = Column(JSONB, nullable=True)
+    content_hash = Column(String(64), nullable=True, index=True)  # sha256 of original file
+    phash = Column(BigInteger, nullable=True, index=True)  # 64 bit dHash of model input
+    created_at = Column(DateTime, nullable=False, default=datetime.now)
     tags = relationship("Tag", secondary="image_tag", backref="images")
 
+    # keyset pagination, newest first
+    __table_args__ = (
+        Index("ix_image_created_at_id", "created_at", "id"),
+        # containment (@>) filters on exif / metainfo keys
+        Index("ix_image_exif", "exif", postgresql_using="gin", postgresql_ops={"exif": "jsonb_path_ops"}),
+        Index("ix_image_metainfo", "metainfo", postgresql_using="gin", postgresql_ops={"metainfo": "jsonb_path_ops"}),
+    )
+
     def __repr__(self):
         return f"Image(id={self.id!r}, original_file_path={self.original_file_path!r}, thumbnail_file_path={self.thumbnail_file_path!r}, description={self.description!r}, exif={self.exif!r}, metainfo={self.metainfo!r}, created_at={self.created_at!r})"
 
 class ImageTag(Base):
     __tablename__ = "image_tag"
     image_id = Column(Integer, ForeignKey("image.id"), primary_key=True)
-    tag_id = Column(Integer, ForeignKey("tag.id"), primary_key=True)
+    tag_id = Column(Integer, ForeignKey("tag.id"), primary_key=True, index=True)
 
 class UserStore(Base):
     __tablename__ = "user_store"
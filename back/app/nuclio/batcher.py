@@ -0,0 +1,113 @@
+from app.config import log
+from collections import Counter, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple
+import asyncio
+import time
+import numpy as np
+
+# (kind, value, future, enqueued_at)
+Item = Tuple[str, str, asyncio.Future, float]
+BatchInfer = Callable[[List[str], List[str]], Awaitable[Tuple[List[List[float]], List[List[float]]]]]
+
+
+class MicroBatcher:
+    """Gathers concurrent text/image embedding requests into one model call.
+
+    The first request of a batch waits up to `window_ms` for more requests
+    (or until `max_batch` are queued), then all of them go to nuclio as one
+    stacked forward pass and results are fanned back to the callers. When no
+    batch is in flight the model is idle, so requests are sent right away and
+    an unloaded worker pays no extra latency.
+    """
+
+    def __init__(self, infer: BatchInfer, window_ms: float, max_batch: int, history: int = 1000) -> None:
+        self.infer = infer
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.queue: Optional[asyncio.Queue] = None
+        self.task: Optional[asyncio.Task] = None
+        # batches in flight, referenced here so they are not garbage collected mid-call
+        self.flushes: Set[asyncio.Task] = set()
+        self.in_flight = 0
+        self.batches = 0
+        self.items = 0
+        self.batch_sizes: Counter = Counter()
+        self.waits: Deque[float] = deque(maxlen=history)
+
+    async def submit(self, kind: str, value: str) -> List[float]:
+        """kind is "text" or "image" (base64 of the image file)"""
+        if self.task is None:
+            self.queue = asyncio.Queue()
+            self.task = asyncio.create_task(self.run())
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((kind, value, future, time.monotonic()))
+        return await future
+
+    async def run(self) -> None:
+        while True:
+            batch = [await self.queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                if not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                    continue
+                timeout = deadline - time.monotonic()
+                if self.in_flight == 0 or timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            self.in_flight += 1
+            flush = asyncio.create_task(self.flush(batch))
+            self.flushes.add(flush)
+            flush.add_done_callback(self.flushes.discard)
+
+    async def flush(self, batch: List[Item]) -> None:
+        now = time.monotonic()
+        self.batches += 1
+        self.items += len(batch)
+        self.batch_sizes[len(batch)] += 1
+        self.waits.extend(now - enqueued_at for _, _, _, enqueued_at in batch)
+        texts = [value for kind, value, _, _ in batch if kind == "text"]
+        images = [value for kind, value, _, _ in batch if kind != "text"]
+        try:
+            text_embeds, image_embeds = await self.infer(texts, images)
+            if len(text_embeds) != len(texts) or len(image_embeds) != len(images):
+                raise ValueError(
+                    f"got {len(text_embeds)}/{len(image_embeds)} embeddings for {len(texts)} texts and {len(images)} images")
+        except Exception as ex:
+            for _, _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(ex)
+            return
+        finally:
+            self.in_flight -= 1
+        text_iter, image_iter = iter(text_embeds), iter(image_embeds)
+        for kind, _, future, _ in batch:
+            embed = next(text_iter) if kind == "text" else next(image_iter)
+            if not future.done():
+                future.set_result(embed)
+
+    def stats(self) -> Dict[str, Any]:
+        waits = np.asarray(self.waits) * 1000
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch_size": self.items / self.batches if self.batches else 0.0,
+            "batch_sizes": dict(sorted(self.batch_sizes.items())),
+            "queue_wait_ms": {
+                "p50": float(np.percentile(waits, 50)) if waits.size else 0.0,
+                "p95": float(np.percentile(waits, 95)) if waits.size else 0.0,
+                "max": float(waits.max()) if waits.size else 0.0,
+            },
+        }
+
+    async def close(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        # let the batches in flight answer their callers
+        await asyncio.gather(*self.flushes, return_exceptions=True)
+        log.debug("inference batcher stopped")
@@ -0,0 +1,117 @@
+from app.config import settings
+
+from app.config import log
+from app.nuclio.batcher import MicroBatcher
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import httpx
+
+Client: Any
+
+HEADERS = {
+    "Content-Type": "application/json",
+    "x-nuclio-function-name": "clip-function",
+    "x-nuclio-function-namespace": "nuclio",
+}
+
+
+class InferenceError(Exception):
+    """Nuclio call failed or returned non 200"""
+
+
+class NuclioClient:
+    """Pooled async client for the CLIP nuclio function.
+
+    One keep-alive connection pool per worker, calls are bounded by a semaphore
+    so a burst of searches queues here instead of piling up on the model.
+    """
+
+    def __init__(self, url: str = None, max_concurrency: int = None) -> None:
+        self.url = url or settings.NUCLIO_API_URL
+        self.http = httpx.AsyncClient(
+            headers=HEADERS,
+            timeout=httpx.Timeout(settings.NUCLIO_TIMEOUT, connect=settings.NUCLIO_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=settings.NUCLIO_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.NUCLIO_MAX_KEEPALIVE,
+            ),
+        )
+        self.semaphore = asyncio.Semaphore(max_concurrency or settings.NUCLIO_MAX_CONCURRENCY)
+        self.batcher: Optional[MicroBatcher] = None
+        if settings.NUCLIO_BATCH_WINDOW_MS > 0:
+            self.batcher = MicroBatcher(
+                lambda texts, images: self.embed_batch(texts=texts, encoded_images=images),
+                window_ms=settings.NUCLIO_BATCH_WINDOW_MS,
+                max_batch=settings.NUCLIO_MAX_BATCH,
+            )
+
+    async def infer(self, payload: Dict[str, Any], timeout: Optional[float] = None) -> Dict[str, Any]:
+        async with self.semaphore:
+            try:
+                response = await self.http.post(
+                    self.url,
+                    json=payload,
+                    timeout=timeout if timeout is not None else httpx.USE_CLIENT_DEFAULT,
+                )
+            except httpx.HTTPError as ex:
+                log.error(f"nuclio request failed {ex!r}")
+                raise InferenceError(str(ex)) from ex
+        if response.status_code != 200:
+            log.error(f"nuclio returned {response.status_code}")
+            raise InferenceError(f"nuclio returned {response.status_code}")
+        return response.json()
+
+    async def embed_batch(self, texts: List[str] = None, encoded_images: List[str] = None,
+                          timeout: Optional[float] = None) -> Tuple[List[List[float]], List[List[float]]]:
+        """Embed many texts and base64 images in one call, returns (text_embeds, image_embeds) in input order"""
+        texts, encoded_images = texts or [], encoded_images or []
+        result = await self.infer({"texts": texts, "images": encoded_images}, timeout=timeout)
+        text_embeds, image_embeds = result.get("text_embed", []), result.get("image_embed", [])
+        if len(text_embeds) != len(texts) or len(image_embeds) != len(encoded_images):
+            log.error(f"nuclio returned {len(text_embeds)}/{len(image_embeds)} embeddings for {len(texts)}/{len(encoded_images)} inputs")
+            raise InferenceError("nuclio returned a wrong number of embeddings")
+        return text_embeds, image_embeds
+
+    async def embed_texts(self, texts: List[str], timeout: Optional[float] = None) -> List[List[float]]:
+        text_embeds, _ = await self.embed_batch(texts=texts, timeout=timeout)
+        return text_embeds
+
+    async def embed_images(self, encoded_images: List[str], timeout: Optional[float] = None) -> List[List[float]]:
+        """encoded_images are base64 of the image files"""
+        _, image_embeds = await self.embed_batch(encoded_images=encoded_images, timeout=timeout)
+        return image_embeds
+
+    async def embed_text(self, text: str, timeout: Optional[float] = None) -> List[float]:
+        if self.batcher is not None:
+            return await self._batched("text", text, timeout)
+        return (await self.embed_texts([text], timeout=timeout))[0]
+
+    async def embed_image(self, encoded_image: str, timeout: Optional[float] = None) -> List[float]:
+        if self.batcher is not None:
+            return await self._batched("image", encoded_image, timeout)
+        return (await self.embed_images([encoded_image], timeout=timeout))[0]
+
+    async def _batched(self, kind: str, value: str, timeout: Optional[float]) -> List[float]:
+        try:
+            return await asyncio.wait_for(self.batcher.submit(kind, value), timeout)
+        except asyncio.TimeoutError as ex:
+            raise InferenceError("inference timed out") from ex
+
+    async def close(self) -> None:
+        if self.batcher is not None:
+            await self.batcher.close()
+        await self.http.aclose()
+
+
+def connect_nuclio():
+    global Client
+    Client = NuclioClient()
+    log.debug("nuclio client created for " + settings.NUCLIO_API_URL)
+
+
+async def close_nuclio():
+    await Client.close()
+
+
+def get_client():
+    return Client
@@ -0,0 +1,4 @@
+from app.nuclio.client import get_client
+
+def get_nuclio():
+    return get_client()
@@ -50,6 +50,8 @@ class ImageCreate(BaseModel):
     exif: dict
     metainfo: Optional[dict]
     tags: List[str]
+    content_hash: Optional[str] = None
+    phash: Optional[int] = None
 
 class UserStoreCreate(BaseModel):
     """
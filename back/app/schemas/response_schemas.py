@@ -33,12 +33,13 @@ class Image(BaseModel):
     original_file_path: str
     thumbnail_file_path: str
     description: str
-    exif: str
+    exif: Dict
     metainfo: Dict
 
-    @field_validator('exif', mode='before')
-    def validate_exif(cls, value):
-        return str(value)
+    @field_validator('exif', 'metainfo', mode='before')
+    def validate_json(cls, value):
+        # rows written before the jsonb backfill have no value yet
+        return value or {}
 
 class ImageResponse(BaseModel):
     model_config = ConfigDict(from_attributes=True)
@@ -47,20 +48,21 @@ class ImageResponse(BaseModel):
     original_file_path: str
     thumbnail_file_path: str
     description: str
-    exif: str
+    exif: Dict
     metainfo: Dict
     has_more: bool
 
-    @field_validator('exif', mode='before')
-    def validate_exif(cls, value):
-        return str(value)
+    @field_validator('exif', 'metainfo', mode='before')
+    def validate_json(cls, value):
+        return value or {}
 
 class ImageListResponse(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 
-    count: int
+    count: int  # total matching images, estimated for large tables
     images: List[Image]
     has_more: bool
+    next_cursor: Optional[str] = None
 
 class ImageList(BaseModel):
     model_config = ConfigDict(from_attributes=True)
@@ -73,6 +75,20 @@ class Tag(BaseModel):
     id: int
     name: str
 
+class ScoredTag(Tag):
+    confidence: float
+
+class TaggedImage(Image):
+    tags: Optional[List[Tag]] = None  # None when tags were not loaded
+
+class TaggedImageList(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    count: int  # total matching images when paged, page length otherwise
+    images: List[TaggedImage]
+    has_more: bool = False
+    next_cursor: Optional[str] = None
+
 class TagList(BaseModel):
     model_config = ConfigDict(from_attributes=True)
     count: int
@@ -100,4 +116,64 @@ class UploadResponse(BaseModel):
     thumbnail_path: str
     embed: List
     similar_image_pth: Optional[str]
-    suggested_tags: Optional[TagList]
\ No newline at end of file
+    suggested_tags: Optional[TagList]
+    predicted_tags: Optional[List[ScoredTag]] = None  # zero-shot, from the tag embeddings
+
+class UploadJob(BaseModel):
+    job_id: str
+    status: str
+
+class UploadJobStatus(BaseModel):
+    job_id: str
+    status: str
+    message: Optional[str] = None
+    result: Optional[UploadResponse] = None
+
+class BatchUploadItem(BaseModel):
+    filename: str
+    status: str
+    message: str
+    image_id: Optional[int] = None
+    full_path: Optional[str] = None
+    thumbnail_path: Optional[str] = None
+    duplicate_of: Optional[int] = None
+    predicted_tags: Optional[List[ScoredTag]] = None
+
+class BatchUploadResponse(BaseModel):
+    count: int
+    uploaded: int
+    failed: int
+    results: List[BatchUploadItem]
+
+class EmbeddingCacheStats(BaseModel):
+    local_hits: int
+    redis_hits: int
+    misses: int
+    hit_rate: float
+    inference_calls_saved: int
+    local_size: int
+
+class QueueWait(BaseModel):
+    p50: float
+    p95: float
+    max: float
+
+class PasswordHashStats(BaseModel):
+    workers: int
+    max_pending: int
+    rounds: int
+    pending: int
+    hashes: int
+    verifies: int
+    rehashes: int
+    rejected: int
+    queue_wait_ms: QueueWait
+    hash_ms: QueueWait
+
+class InferenceBatcherStats(BaseModel):
+    enabled: bool
+    batches: int = 0
+    items: int = 0
+    mean_batch_size: float = 0.0
+    batch_sizes: Dict[int, int] = {}
+    queue_wait_ms: Optional[QueueWait] = None
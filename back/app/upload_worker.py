@@ -0,0 +1,59 @@
+"""Standalone upload worker, consumes the redis upload job queue
+
+    python -m app.upload_worker --workers 4
+
+Refuses to run with VECTOR_BACKEND=hnsw: images it stores would not reach the
+in-memory hnsw index of the api processes until they restart.
+"""
+from argparse import ArgumentParser
+import asyncio
+
+from app.config import log
+from app.config import settings
+from app.core.database import init_db
+from app.s3.storage import connect_storage, get_client
+from app.click.clickhouse import connect_clickhouse, get_client as get_click_client
+from app.click.vector_index import connect_vector_index
+from app.click.tag_index import connect_tag_index, close_tag_index
+from app.cache.redis import connect_redis, close_redis, get_redis
+from app.nuclio.client import connect_nuclio, close_nuclio, get_client as get_nuclio_client
+from app.utils.imaging import connect_image_pool, close_image_pool
+
+
+async def run(workers: int):
+    if settings.VECTOR_BACKEND == "hnsw":
+        log.error("VECTOR_BACKEND=hnsw keeps a per-process index, run the upload workers inside the api (UPLOAD_WORKERS)")
+        raise SystemExit(1)
+    init_db()
+    # crud pulls in core.dependencies, which needs the session factory from init_db
+    from app.core.jobs import start_upload_workers, Workers
+    connect_storage()
+    connect_clickhouse()
+    # only the memory-mapped numpy index is shared with the api workers
+    if settings.VECTOR_BACKEND == "numpy":
+        connect_vector_index(get_click_client())
+    connect_redis()
+    connect_nuclio()
+    connect_tag_index(get_nuclio_client())
+    if settings.IMAGE_PROCESSING == "local":
+        connect_image_pool(settings.IMAGE_WORKERS)
+    start_upload_workers(get_redis(), get_client(), get_click_client(), get_nuclio_client(), count=workers)
+    try:
+        await asyncio.gather(*Workers)
+    finally:
+        await close_tag_index()
+        await close_nuclio()
+        close_image_pool()
+        await close_redis()
+        log.info("upload worker stopped")
+
+
+def main():
+    parser = ArgumentParser(description="Process asynchronous uploads")
+    parser.add_argument("--workers", type=int, default=settings.UPLOAD_WORKERS or 1)
+    args = parser.parse_args()
+    asyncio.run(run(args.workers))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,19 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+from typing import Tuple
+import json
+
+
+def encode_cursor(created_at: datetime, image_id: int) -> str:
+    """opaque token of the last (created_at, id) on a page"""
+    raw = json.dumps([created_at.isoformat(), image_id], separators=(",", ":")).encode()
+    return urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """(created_at, id) of a token made by encode_cursor, ValueError if malformed"""
+    try:
+        created_at, image_id = json.loads(urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return datetime.fromisoformat(created_at), int(image_id)
+    except (TypeError, ValueError) as ex:
+        raise ValueError(f"invalid cursor {cursor!r}") from ex
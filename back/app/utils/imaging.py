@@ -0,0 +1,88 @@
+"""Thumbnail and model input rendering, runs in a process pool.
+
+Kept free of app imports, the worker side only needs Pillow.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+import multiprocessing
+from typing import BinaryIO, Optional, Tuple, Union
+from PIL import Image, ImageOps
+
+THUMBNAIL_SIZE = (700, 700)
+MODEL_INPUT_SIZE = (288, 288)
+
+Pool: Optional[ProcessPoolExecutor] = None
+
+
+def to_png(img: Image.Image) -> bytes:
+    buffer = BytesIO()
+    img.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def open_image(source: Union[bytes, BinaryIO], size: Tuple[int, int]) -> Image.Image:
+    img = Image.open(BytesIO(source) if isinstance(source, bytes) else source)
+    if img.format == "JPEG":
+        # let libjpeg decode at 1/2..1/8 scale, result is still >= requested size
+        img.draft("RGB", size)
+    return ImageOps.exif_transpose(img)
+
+
+def render_variants(source: Union[bytes, BinaryIO]) -> Tuple[bytes, bytes]:
+    """Decode the original once and return (thumbnail, model input) png bytes.
+
+    thumbnail fits in 700x700 keeping aspect ratio (imgproxy rs:fit),
+    model input is forced to 288x288 (imgproxy rs:force).
+    """
+    img = open_image(source, THUMBNAIL_SIZE)
+    if img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGBA" if "transparency" in img.info or img.mode in ("LA", "PA") else "RGB")
+    thumbnail = img.copy()
+    thumbnail.thumbnail(THUMBNAIL_SIZE, Image.LANCZOS)
+    model_input = img.convert("RGB").resize(MODEL_INPUT_SIZE, Image.BICUBIC)
+    return to_png(thumbnail), to_png(model_input)
+
+
+def render_model_input(source: Union[bytes, BinaryIO]) -> bytes:
+    """288x288 png for the model only, decoded at the smallest draft scale"""
+    img = open_image(source, MODEL_INPUT_SIZE)
+    return to_png(img.convert("RGB").resize(MODEL_INPUT_SIZE, Image.BICUBIC))
+
+
+def dhash(png: bytes) -> int:
+    """64 bit difference hash as signed int64 (fits a postgres bigint)"""
+    img = Image.open(BytesIO(png)).convert("L").resize((9, 8), Image.BILINEAR)
+    pixels = list(img.getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def connect_image_pool(workers: int):
+    global Pool
+    context = multiprocessing.get_context("forkserver")
+    # the fork server preloads only this module, not __main__
+    context.set_forkserver_preload([__name__])
+    Pool = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+
+
+def close_image_pool():
+    global Pool
+    if Pool is not None:
+        Pool.shutdown(cancel_futures=True)
+        Pool = None
+
+
+def render(file: BinaryIO, size: int, pool_max_bytes: int) -> Tuple[bytes, bytes]:
+    """render_variants of a seekable stream.
+
+    Files up to pool_max_bytes are copied to the pool, bigger ones are decoded
+    straight from the stream in the calling thread so they are never held in
+    memory as a whole (Pillow releases the GIL while decoding).
+    """
+    file.seek(0)
+    if Pool is None or size > pool_max_bytes:
+        return render_variants(file)
+    return Pool.submit(render_variants, file.read()).result()
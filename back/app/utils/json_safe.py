@@ -0,0 +1,33 @@
+from numbers import Rational
+from typing import Any
+
+
+def json_safe(value: Any) -> Any:
+    """Plain json value for a jsonb column.
+
+    Pillow exif holds IFDRational, bytes and tuples. Rationals become floats,
+    bytes are decoded as utf-8 when possible and dropped otherwise, and NUL
+    characters (rejected by postgres jsonb) are stripped.
+    """
+    if isinstance(value, dict):
+        items = ((str(key).replace("\x00", ""), json_safe(item)) for key, item in value.items())
+        return {key: item for key, item in items if item is not None}
+    if isinstance(value, (list, tuple)):
+        return [json_safe(item) for item in value]
+    if isinstance(value, bytes):
+        try:
+            return value.decode("utf-8").replace("\x00", "")
+        except UnicodeDecodeError:
+            return None
+    if isinstance(value, str):
+        return value.replace("\x00", "")
+    if isinstance(value, (bool, int)) or value is None:
+        return value
+    if isinstance(value, float):
+        return value if value == value and abs(value) != float("inf") else None
+    if isinstance(value, Rational):
+        return float(value) if value.denominator else None
+    try:
+        return json_safe(float(value))
+    except (TypeError, ValueError):
+        return str(value).replace("\x00", "")
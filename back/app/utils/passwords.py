@@ -0,0 +1,119 @@
+"""bcrypt hashing in a dedicated bounded thread pool.
+
+A bcrypt round costs 100-300 ms of CPU. Run inline in an async handler, that
+freezes every other request of the worker. Hashes run in
+PASSWORD_HASH_WORKERS threads instead (bcrypt releases the GIL). At most
+PASSWORD_HASH_MAX_PENDING calls may be queued or running; beyond that
+callers get PasswordHashBusy right away instead of piling up. The cost factor
+is BCRYPT_ROUNDS. Hashes made with other parameters still verify, and
+verify_and_update returns a fresh hash for them so logins upgrade them.
+"""
+from app.config import settings
+from app.config import log
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from passlib.context import CryptContext
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+import asyncio
+import time
+import numpy as np
+
+pwd_context = CryptContext(schemes=["bcrypt"], bcrypt__rounds=settings.BCRYPT_ROUNDS)
+
+Hasher: Optional["PasswordHasher"] = None
+
+
+class PasswordHashBusy(Exception):
+    """Too many password hashes queued"""
+
+
+class PasswordHasher:
+
+    def __init__(self, workers: int = None, max_pending: int = None, history: int = 1000) -> None:
+        self.workers = workers or settings.PASSWORD_HASH_WORKERS
+        self.max_pending = max_pending or settings.PASSWORD_HASH_MAX_PENDING
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-hash")
+        self.pending = 0
+        self.hashes = 0
+        self.verifies = 0
+        self.rehashes = 0
+        self.rejected = 0
+        self.waits: Deque[float] = deque(maxlen=history)
+        self.durations: Deque[float] = deque(maxlen=history)
+
+    async def run(self, fn: Callable, *args: Any) -> Any:
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise PasswordHashBusy(f"{self.pending} password hashes pending")
+        self.pending += 1
+        enqueued_at = time.monotonic()
+
+        def timed():
+            started_at = time.monotonic()
+            try:
+                return fn(*args)
+            finally:
+                self.waits.append(started_at - enqueued_at)
+                self.durations.append(time.monotonic() - started_at)
+
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, timed)
+        finally:
+            self.pending -= 1
+
+    async def hash(self, password: str) -> str:
+        hashed_password = await self.run(pwd_context.hash, password)
+        self.hashes += 1
+        return hashed_password
+
+    async def verify_and_update(self, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        """(password matches, new hash when the stored one uses outdated parameters)"""
+        valid, new_hash = await self.run(pwd_context.verify_and_update, password, hashed_password)
+        self.verifies += 1
+        if new_hash is not None:
+            self.rehashes += 1
+        return valid, new_hash
+
+    def stats(self) -> Dict[str, Any]:
+        waits = np.asarray(self.waits) * 1000
+        durations = np.asarray(self.durations) * 1000
+        return {
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "rounds": settings.BCRYPT_ROUNDS,
+            "pending": self.pending,
+            "hashes": self.hashes,
+            "verifies": self.verifies,
+            "rehashes": self.rehashes,
+            "rejected": self.rejected,
+            "queue_wait_ms": {
+                "p50": float(np.percentile(waits, 50)) if waits.size else 0.0,
+                "p95": float(np.percentile(waits, 95)) if waits.size else 0.0,
+                "max": float(waits.max()) if waits.size else 0.0,
+            },
+            "hash_ms": {
+                "p50": float(np.percentile(durations, 50)) if durations.size else 0.0,
+                "p95": float(np.percentile(durations, 95)) if durations.size else 0.0,
+                "max": float(durations.max()) if durations.size else 0.0,
+            },
+        }
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def connect_password_hasher():
+    global Hasher
+    Hasher = PasswordHasher()
+    log.debug(f"password hashing: {Hasher.workers} threads, bcrypt rounds {settings.BCRYPT_ROUNDS}")
+
+
+def close_password_hasher():
+    global Hasher
+    if Hasher is not None:
+        Hasher.close()
+        Hasher = None
+
+
+def get_password_hasher() -> PasswordHasher:
+    return Hasher
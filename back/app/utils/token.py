@@ -1,6 +1,8 @@
-from app.core import crud
+from app.core import async_crud
 from app.config import settings
-from app.core.dependencies import pwd_context, oauth2_scheme, get_db, alternate_oauth2_scheme
+from app.cache.principal_cache import get_principal_cache
+from app.utils.passwords import get_password_hasher
+from app.core.dependencies import oauth2_scheme, get_async_db, alternate_oauth2_scheme
 from app.schemas.response_schemas import TokenData, User
 from app.config import log
 
@@ -8,16 +10,7 @@ from jose import jwt, JWTError
 from typing import Optional, Annotated
 from fastapi import HTTPException, status, Depends
 from datetime import datetime, timedelta
-from sqlalchemy.orm import Session
-
-
-def verify_password(plain_password, hashed_password):
-    log.info(f"Verifying password {plain_password} against {hashed_password}")
-    return pwd_context.verify(plain_password, hashed_password)
-
-
-def get_password_hash(password):
-    return pwd_context.hash(password)
+from sqlalchemy.ext.asyncio import AsyncSession
 
 
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
@@ -33,12 +26,16 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     return encoded_jwt
 
 
-def authenticate_user(db: Session, email: str, password: str):
-    user = crud.get_user(db, email)
+async def authenticate_user(db: AsyncSession, email: str, password: str):
+    """user with this email and password or False, hashes with outdated parameters are replaced"""
+    user = await async_crud.get_user(db, email)
     if user is None:
         return False
-    if not verify_password(password, user.hashed_password):
+    valid, new_hash = await get_password_hasher().verify_and_update(password, user.hashed_password)
+    if not valid:
         return False
+    if new_hash is not None:
+        await async_crud.update_password_hash(db, user.id, new_hash)
     return user
 
 no_token_exception = HTTPException(
@@ -49,7 +46,7 @@ no_token_exception = HTTPException(
 
 async def get_current_user(
         token: Annotated[str, Depends(alternate_oauth2_scheme)],
-        db: Session = Depends(get_db),
+        db: AsyncSession = Depends(get_async_db),
 ):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -58,19 +55,22 @@ async def get_current_user(
     )
     if token is None or token == "":
         return None
-    log.info(f'Getting current user from token {token}')
     try:
         payload = jwt.decode(
             token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM]
         )
-        log.info(f'{payload}')
         email: str = payload.get("email")
         if email is None:
             raise credentials_exception
         token_data = TokenData(email=email)
     except JWTError:
         raise credentials_exception
-    user = crud.get_user(db, email=token_data.email)
+    principal_cache = get_principal_cache()
+    if principal_cache is not None:
+        user = await principal_cache.get(token_data.email)
+        if user is not None:
+            return user
+    user = await async_crud.get_user(db, email=token_data.email)
     if user is None:
         raise credentials_exception
     user = User(
@@ -78,6 +78,8 @@ async def get_current_user(
         username=user.username,
         email=user.email,
     )
+    if principal_cache is not None:
+        await principal_cache.set(user)
     return user
 
 
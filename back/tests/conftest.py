@@ -0,0 +1,29 @@
+import os
+import sys
+
+# settings has no defaults for the service credentials, the unit tests never connect
+for name, value in {
+    "SERVICE_NAME": "test",
+    "POSTGRES_USER": "test",
+    "POSTGRES_PASSWORD": "test",
+    "POSTGRES_PORT": "5432",
+    "POSTGRES_DB": "test",
+    "CLICKHOUSE_DB": "test",
+    "CLICKHOUSE_USER": "test",
+    "CLICKHOUSE_PASSWORD": "test",
+    "CLICKHOUSE_HOST": "localhost",
+    "CLICKHOUSE_PORT": "8123",
+    "ACCESS_SECRET": "test",
+    "ACCESS_KEY": "test",
+    "REGION": "test",
+    "DEFAULT_BUCKET": "test",
+    "SECRET_KEY": "test",
+}.items():
+    os.environ.setdefault(name, value)
+
+# imported once the settings can be built
+from app.config import log  # noqa: E402
+
+# app.config also logs to the tracked debug.log, test runs only log to stderr
+log.remove()
+log.add(sys.stderr, level="DEBUG")
@@ -0,0 +1,54 @@
+from app.click.numpy_index import NumpyIndex
+import numpy as np
+import os
+
+
+def write_pre_tags_index(path, ids, vectors, capacity=8):
+    """index directory as written before tag ids were stored: no tags.u32"""
+    os.makedirs(path, exist_ok=True)
+    embeddings = np.zeros((capacity, vectors.shape[1]), dtype=np.float32)
+    embeddings[:len(ids)] = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    embeddings.tofile(os.path.join(path, "embeddings.f32"))
+    padded = np.zeros(capacity, dtype=np.int64)
+    padded[:len(ids)] = ids
+    padded.tofile(os.path.join(path, "ids.i64"))
+    np.asarray([len(ids)], dtype=np.int64).tofile(os.path.join(path, "size.i64"))
+
+
+class Client:
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def query_row_block_stream(self, query):
+        rows = self.rows
+
+        class Stream:
+            def __enter__(self):
+                return iter([rows])
+
+            def __exit__(self, *args):
+                return False
+
+        return Stream()
+
+
+def test_opens_index_written_without_tags(tmp_path):
+    vectors = np.eye(3, 4, dtype=np.float32)
+    write_pre_tags_index(tmp_path, [1, 2, 3], vectors)
+    index = NumpyIndex(path=str(tmp_path), dim=4, max_tags=2)
+    assert index.stale
+    assert os.path.getsize(tmp_path / "tags.u32") == 8 * 2 * 4
+    assert index.search(vectors[1].tolist(), 1) == [(2, 0.0)]
+
+    # a stale index reloads once so the rows get their tags
+    index.load(Client([(1, vectors[0].tolist(), [7]), (2, vectors[1].tolist(), []), (3, vectors[2].tolist(), [7])]))
+    assert not index.stale
+    assert [image_id for image_id, _ in index.search(vectors[0].tolist(), 3, tag_ids=[7])] == [1, 3]
+
+
+def test_reopens_index_with_tags(tmp_path):
+    NumpyIndex(path=str(tmp_path), dim=4, capacity=8, max_tags=2).add([1], [[1, 0, 0, 0]], [[5]])
+    index = NumpyIndex(path=str(tmp_path), dim=4, max_tags=2)
+    assert not index.stale
+    assert index.search([1, 0, 0, 0], 1, tag_ids=[5]) == [(1, 0.0)]
@@ -0,0 +1,71 @@
+from app.click.rerank import banded, mmr, rerank
+from app.config import settings
+import numpy as np
+import pytest
+
+
+def reference(rows):
+    """the selection banded replaced (get_propper_probalities), for rows nearest first"""
+    picked = []
+    similarity = np.array([1 - distance for _, distance in rows])
+    near = (similarity >= 0.9) & (similarity < 0.98)
+    if near.any():
+        picked.append(rows[np.flatnonzero(near)[0]])
+    top, step = min(0.9, similarity[0]), 0.01
+    while len(picked) < 5 and top - step > 0.65:
+        band = (similarity >= top - step) & (similarity < top)
+        if band.any():
+            picked.append(rows[np.flatnonzero(band)[0]])
+            top = similarity[band].max() - 0.015
+        else:
+            top -= step
+    return picked
+
+
+def rows_of(distances):
+    return [(i, float(distance)) for i, distance in enumerate(sorted(distances))]
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_banded_matches_reference(seed):
+    rng = np.random.default_rng(seed)
+    rows = rows_of(rng.uniform(0.02, rng.uniform(0.05, 0.6), rng.integers(1, 100)))
+    assert banded(rows, 5, 0.015, 0.65) == reference(rows)
+
+
+def test_banded_skips_gaps():
+    rows = rows_of([0.03, 0.031, 0.2, 0.21, 0.3])
+    assert banded(rows, 5, 0.015, 0.65) == reference(rows) == [rows[0], rows[2], rows[4]]
+
+
+def test_banded_all_near_duplicates():
+    rows = rows_of([0.021, 0.03, 0.05, 0.08, 0.09])
+    assert banded(rows, 5, 0.015, 0.65) == reference(rows)
+    assert banded(rows, 5, 0.015, 0.65)[0] == rows[0]
+
+
+def test_banded_stops_at_floor():
+    rows = rows_of([0.05, 0.3, 0.34, 0.4, 0.5])
+    picked = banded(rows, 5, 0.015, 0.65)
+    assert picked == reference(rows)
+    assert all(1 - distance > 0.65 for _, distance in picked)
+
+
+def test_rerank_drops_candidates_below_min_similarity(monkeypatch):
+    monkeypatch.setattr(settings, "RERANK_METHOD", "banded")
+    rows = rows_of([0.4, 0.5, 0.6])
+    assert all(1 - distance < settings.RERANK_MIN_SIMILARITY for _, distance in rows)
+    assert rerank(None, rows) == []
+
+
+def test_mmr_without_diversity_is_top_k():
+    rows = rows_of([0.1, 0.2, 0.3, 0.4])
+    vectors = np.eye(4, dtype=np.float32)
+    assert mmr(rows, vectors, 3, 0.0) == rows[:3]
+
+
+def test_mmr_prefers_less_redundant_candidate():
+    rows = rows_of([0.1, 0.11, 0.2])
+    # the second candidate is a copy of the first, the third points elsewhere
+    vectors = np.array([[1, 0], [1, 0], [0, 1]], dtype=np.float32)
+    assert mmr(rows, vectors, 2, 0.5) == [rows[0], rows[2]]
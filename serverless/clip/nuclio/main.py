@@ -12,22 +12,37 @@ def init_context(context):
     context.user_data.model = model
     context.logger.info("Init context...100%")
 
+def decode_image(encoded: str) -> Image.Image:
+    buf = io.BytesIO(base64.b64decode(encoded))
+    return Image.open(buf).convert('RGB')
+
 def handler(context, event):
-    context.logger.info("Run CLIP model")
+    """Embed a batch of texts and/or images.
+
+    Body: {"mode": "text" | "image", "texts": [...], "images": [base64, ...]}
+    ("image": base64 is still accepted for a single image).
+    Response: {"text_embed": [...], "image_embed": [...], "embed": <list for mode>},
+    every list in input order.
+    """
     data = event.body
-    mode = data["mode"]
-    embed = []
+    mode = data.get("mode")
+    texts = data.get("texts") or []
+    images = data.get("images") or []
+    if "image" in data:
+        images = [data["image"]] + images
+    context.logger.info(f"Run CLIP model on {len(texts)} texts, {len(images)} images")
 
-    if mode == "text":
-        text_list = data["texts"]
-        embed.append(context.user_data.model.get_text_embedding(text_list))
-    else:
-        buf = io.BytesIO(base64.b64decode(data["image"]))
-        image = Image.open(buf).convert('RGB')
-        embed.append(context.user_data.model.get_image_embedding(image))
+    text_embed = []
+    image_embed = []
+    if texts:
+        text_embed = context.user_data.model.get_text_embeddings(texts)
+    if images:
+        image_embed = context.user_data.model.get_image_embeddings([decode_image(image) for image in images])
 
     results = {
-        'embed': embed
+        'text_embed': text_embed,
+        'image_embed': image_embed,
+        'embed': text_embed if mode == "text" else image_embed,
     }
     return context.Response(body=json.dumps(results), headers={},
         content_type='application/json', status_code=200)
@@ -8,23 +8,40 @@ import clip
 from multilingual_clip.legacy_multilingual_clip import load_model
 from PIL import Image
 
+# largest stacked tensor sent through a model at once, bigger requests are chunked
+BATCH_SIZE = int(os.environ.get("CLIP_BATCH_SIZE", 32))
+
 class ModelHandler:
-    def __init__(self, text_model_tag: str = "M-BERT-Distil-40", cv_model_tag: str = "RN50x4") -> None:
+    def __init__(self, text_model_tag: str = "M-BERT-Distil-40", cv_model_tag: str = "RN50x4", batch_size: int = BATCH_SIZE) -> None:
         self.text_model = load_model(text_model_tag)
         self.cv_model, self.image_preprocess = clip.load(cv_model_tag)
         self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        self.batch_size = batch_size
+
+    def get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """Embed N texts, result keeps input order"""
+        embeds = []
+        with torch.no_grad():
+            for i in range(0, len(texts), self.batch_size):
+                embeds.extend(self.text_model(texts[i:i + self.batch_size]).to('cpu').tolist())
+        return embeds
 
     def get_text_embedding(self, texts: List[str]) -> List:
-        return self.text_model(texts).to('cpu').tolist()[0]
+        return self.get_text_embeddings(texts[:1])[0]
 
     def to(self, device):
         self.device = device
         self.text_model.to(device)
         self.cv_model.to(device)
 
-    def get_image_embedding(self, image) -> List:
+    def get_image_embeddings(self, images: List[Image.Image]) -> List[List[float]]:
+        """Embed N images as stacked tensors, result keeps input order"""
+        embeds = []
+        with torch.no_grad():
+            for i in range(0, len(images), self.batch_size):
+                batch = torch.stack([self.image_preprocess(image) for image in images[i:i + self.batch_size]]).to(self.device)
+                embeds.extend(self.cv_model.encode_image(batch).to('cpu').tolist())
+        return embeds
 
-        image = self.image_preprocess(image).unsqueeze(0).to(self.device)
-        image = self.cv_model.encode_image(image)
-
-        return image.to('cpu').tolist()[0]
\ No newline at end of file
+    def get_image_embedding(self, image) -> List:
+        return self.get_image_embeddings([image])[0]